@@ -1,11 +1,30 @@
-from flask import Flask, render_template, request, jsonify, session, redirect, url_for
+from flask import Flask, Response, g, render_template, request, jsonify, session, redirect, url_for
+from flask.json.provider import DefaultJSONProvider
 from datetime import datetime, timedelta
 from functools import wraps
-import json
+import bisect
 import os
 import random
+import threading
+import time
 import google.generativeai as genai
 from dotenv import load_dotenv
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+import document
+import json_codec
+import schema
+from compression import init_compression
+from assets import init_assets
+import events
+import habit_stats
+import item_ids
+import leaderboard
+import milestones
+import progress_stats
+import rate_limit
 
 # Load environment variables from .env file
 load_dotenv()
@@ -15,7 +34,7 @@ USE_DATABASE = bool(os.environ.get('DATABASE_URL', '').strip())
 
 if USE_DATABASE:
     try:
-        from database import init_db, get_user, create_user, update_user_data, get_all_users
+        from database import init_db, get_user, create_user, update_user_data, get_all_users, READ_AFTER_WRITE_SECONDS
         print("✅ Using PostgreSQL database")
     except ImportError as e:
         USE_DATABASE = False
@@ -26,7 +45,19 @@ if USE_DATABASE:
 else:
     print("⚠️ No DATABASE_URL found, using JSON file for local development")
 
+class CodecJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider backed by json_codec (orjson when installed)"""
+
+    def dumps(self, obj, **kwargs):
+        return json_codec.dumps(obj)
+
+    def loads(self, s, **kwargs):
+        return json_codec.loads(s)
+
 app = Flask(__name__, static_folder='static', static_url_path='/static')
+app.json = CodecJSONProvider(app)
+init_compression(app)
+init_assets(app)
 
 # Configure Gemini API
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY', '').strip()
@@ -37,18 +68,27 @@ if GEMINI_API_KEY:
 else:
     gemini_model = None
     print("⚠️ No GEMINI_API_KEY found, using static quotes")
+print(f"✅ JSON codec: {json_codec.BACKEND}")
 app.secret_key = os.environ.get('SECRET_KEY', '').strip() or 'dev-key-change-in-production'
 app.config['SESSION_COOKIE_SAMESITE'] = 'Lax'
 app.config['SESSION_COOKIE_SECURE'] = False  # Set True only for HTTPS
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=24)
 
 DATA_FILE = 'users_data.json'
+ARCHIVE_FILE = 'users_archive.json.z'
+# Users who haven't saved anything for this long are moved to cold storage
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+# Usernames allowed to use the /api/admin routes (comma-separated)
+ADMIN_USERS = {name.strip() for name in os.environ.get('ADMIN_USERS', '').split(',') if name.strip()}
 
 # Initialize database if using it
 if USE_DATABASE:
     try:
         print(f"📊 DATABASE_URL detected: {os.environ.get('DATABASE_URL', '')[:60]}...")
-        init_db()
+        # Under gunicorn the master sets up the schema once, before forking
+        # the workers (see gunicorn.conf.py); scripts and the dev server do it here
+        if not os.environ.get('DB_SCHEMA_READY'):
+            init_db()
         print("✅ Database connected and initialized")
         # Test database connectivity
         try:
@@ -63,6 +103,10 @@ if USE_DATABASE:
         USE_DATABASE = False
         print("⚠️ Falling back to JSON file")
 
+events.init_events(USE_DATABASE)
+habit_stats.init_habit_stats(USE_DATABASE)
+leaderboard.init_leaderboard(USE_DATABASE, DATA_FILE)
+
 # Bible verses for daily motivation
 BIBLE_VERSES = [
     {"text": "I can do all things through Christ who strengthens me.", "reference": "Philippians 4:13"},
@@ -112,31 +156,151 @@ MOTIVATION_QUOTES = [
 ]
 
 # JSON file functions
+class UsersFileLock:
+    """Re-entrant lock for read-modify-write cycles on the users file
+    
+    Held across the threads of this process (RLock) and across processes:
+    gunicorn workers, archive_users.py and migrate_schema.py all take an
+    flock on DATA_FILE.lock (where fcntl exists, i.e. not on Windows).
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._depth = 0
+        self._file = None
+    
+    def __enter__(self):
+        self._lock.acquire()
+        if self._depth == 0 and fcntl is not None:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        self._depth += 1
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._depth -= 1
+        if self._depth == 0 and self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._lock.release()
+
+users_file_lock = UsersFileLock(f"{DATA_FILE}.lock")
+
 def load_users():
     if not os.path.exists(DATA_FILE):
         return {}
     try:
-        with open(DATA_FILE, 'r') as f:
-            return json.load(f)
+        with open(DATA_FILE, 'r', encoding='utf-8') as f:
+            return json_codec.loads(f.read())
     except:
         return {}
 
 def save_users(users):
     try:
-        with open(DATA_FILE, 'w') as f:
-            json.dump(users, f, indent=2)
+        # Write to a temp file and swap it in so readers never see a partial file
+        tmp_file = f"{DATA_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            f.write(json_codec.dumps(users, indent=True))
+        os.replace(tmp_file, DATA_FILE)
         return True
     except Exception as e:
         print(f"Error saving users: {str(e)}")
         return False
 
+# Cold storage for the JSON file: dormant users move to ARCHIVE_FILE, one
+# json_codec.pack()ed object keyed by username (see archive_users.py)
+
+def load_archive():
+    if not os.path.exists(ARCHIVE_FILE):
+        return {}
+    with open(ARCHIVE_FILE, 'rb') as f:
+        return json_codec.unpack(f.read())
+
+def save_archive(archive):
+    tmp_file = f"{ARCHIVE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'wb') as f:
+        f.write(json_codec.pack(archive))
+    os.replace(tmp_file, ARCHIVE_FILE)
+
+_archive_names = None  # ((mtime, size) of ARCHIVE_FILE, frozenset of usernames)
+_archive_names_lock = threading.Lock()
+
+def archived_file_usernames():
+    """Usernames in ARCHIVE_FILE, decompressed again only when the file changes"""
+    global _archive_names
+    try:
+        stat = os.stat(ARCHIVE_FILE)
+    except OSError:
+        return frozenset()
+    key = (stat.st_mtime_ns, stat.st_size)
+    with _archive_names_lock:
+        if _archive_names is None or _archive_names[0] != key:
+            _archive_names = (key, frozenset(load_archive()))
+        return _archive_names[1]
+
+def restore_archived_file_user(username):
+    """Move username from the archive back into the users file, or return None"""
+    # Unknown names (logins, registrations) mostly aren't archived users;
+    # don't take the file lock for them
+    if username not in archived_file_usernames():
+        return None
+    with users_file_lock:
+        archive = load_archive()
+        user = archive.pop(username, None)
+        if user is None:
+            return None
+        
+        users = load_users()
+        user['lastActive'] = datetime.now().isoformat()
+        users.setdefault(username, user)
+        if not save_users(users):
+            return None
+        save_archive(archive)
+        print(f"📦 Restored {username} from cold storage")
+        return users[username]
+
+def archive_dormant_file_users(days, dry_run=False):
+    """Move users idle for days into ARCHIVE_FILE, returns a size report"""
+    cutoff = datetime.now() - timedelta(days=days)
+    with users_file_lock:
+        users = load_users()
+        bytes_before = os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else 0
+        
+        dormant = []
+        stamped = False
+        for username, user in users.items():
+            # Users from before cold storage count as active from now on
+            if 'lastActive' not in user:
+                user['lastActive'] = datetime.now().isoformat()
+                stamped = True
+            elif datetime.fromisoformat(user['lastActive']) < cutoff:
+                dormant.append(username)
+        
+        if not dry_run and (dormant or stamped):
+            if dormant:
+                archive = load_archive()
+                for username in dormant:
+                    archive[username] = users.pop(username)
+                # Archive first: a crash in between leaves a user in both, never neither
+                save_archive(archive)
+            save_users(users)
+        
+        return {
+            'users': dormant,
+            'bytes_before': bytes_before,
+            'bytes_after': os.path.getsize(DATA_FILE) if os.path.exists(DATA_FILE) else 0,
+            'archive_bytes': os.path.getsize(ARCHIVE_FILE) if os.path.exists(ARCHIVE_FILE) else 0,
+        }
+
 # Wrapper functions
-def get_user_wrapper(username):
+def get_user_wrapper(username, replica_ok=False):
     if USE_DATABASE:
-        return get_user(username)
+        return get_user(username, replica_ok=replica_ok)
     else:
         users = load_users()
-        return users.get(username)
+        return users.get(username) or restore_archived_file_user(username)
 
 def create_user_wrapper(username, passcode, data):
     if USE_DATABASE:
@@ -163,41 +327,60 @@ def create_user_wrapper(username, passcode, data):
             print(f"❌ Full traceback: {traceback.format_exc()}")
             return False
     else:
-        users = load_users()
-        if username in users:
-            return False
-        users[username] = {
-            'passcode': passcode,
-            'username': username,
-            'created': datetime.now().isoformat(),
-            'data': data
-        }
-        return save_users(users)
+        with users_file_lock:
+            users = load_users()
+            if username in users:
+                return False
+            users[username] = {
+                'passcode': passcode,
+                'username': username,
+                'created': datetime.now().isoformat(),
+                'lastActive': datetime.now().isoformat(),
+                'data': data
+            }
+            return save_users(users)
 
-def update_user_data_wrapper(username, data):
-    """Update user data with proper error handling"""
+def update_user_data_wrapper(username, data, base_version=None, durable=False):
+    """Update user data with proper error handling
+    
+    With base_version, raises document.VersionConflict if the stored document
+    has moved past that version since it was loaded.
+    """
     try:
         if USE_DATABASE:
-            update_user_data(username, data)
+            update_user_data(username, data, base_version=base_version, durable=durable)
             print(f"✅ Database updated for {username}")
             return True
         else:
-            users = load_users()
-            if username in users:
-                users[username]['data'] = data
-                success = save_users(users)
-                if success:
-                    print(f"✅ JSON file updated for {username}")
+            with users_file_lock:
+                users = load_users()
+                if username in users:
+                    stored_version = users[username]['data'].get('version', 0)
+                    if base_version is not None and stored_version != base_version:
+                        raise document.VersionConflict(f"{username}'s document is at version {stored_version}")
+                    users[username]['data'] = data
+                    users[username]['lastActive'] = datetime.now().isoformat()
+                    success = save_users(users)
+                    if success:
+                        print(f"✅ JSON file updated for {username}")
+                    else:
+                        print(f"❌ JSON file save failed for {username}")
+                    return success
                 else:
-                    print(f"❌ JSON file save failed for {username}")
-                return success
-            else:
-                print(f"❌ User {username} not found")
-                return False
+                    print(f"❌ User {username} not found")
+                    return False
+    except document.VersionConflict:
+        raise
     except Exception as e:
         print(f"❌ Error updating user data for {username}: {str(e)}")
         return False
 
+@app.errorhandler(document.VersionConflict)
+def version_conflict(e):
+    """Another request saved the document first; the client reloads and retries"""
+    print(f"⚠️ Version conflict: {str(e)}")
+    return jsonify({'error': 'Your data was changed elsewhere, reload and try again'}), 409
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -206,44 +389,136 @@ def login_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
-def get_user_data(username):
-    user = get_user_wrapper(username)
+def admin_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if session.get('user_id') not in ADMIN_USERS:
+            return jsonify({'error': 'Admin access required'}), 403
+        return f(*args, **kwargs)
+    return decorated_function
+
+def expensive(route):
+    """Rate limit a logged-in route per user and cap how many run at once
+    
+    route names its budget in rate_limit.BUDGETS. Over budget is 429, no free
+    slot is 503; both carry Retry-After and are answered without waiting.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            retry_after = rate_limit.take(route, session['user_id'])
+            if retry_after is not None:
+                return jsonify({'error': 'Too many requests, try again later'}), 429, {'Retry-After': str(int(retry_after) + 1)}
+            
+            slot = rate_limit.acquire_slot()
+            if slot is None:
+                return jsonify({'error': 'Server busy, try again shortly'}), 503, {'Retry-After': str(rate_limit.BUSY_RETRY_AFTER)}
+            try:
+                return f(*args, **kwargs)
+            finally:
+                rate_limit.release_slot(slot)
+        return decorated_function
+    return decorator
+
+def replica_read_ok():
+    """Whether this session's reads may go to a read replica
+    
+    Not within READ_AFTER_WRITE_SECONDS of the session's own last write, so a
+    lagging replica can't hand back a document older than what it just saved.
+    """
+    return USE_DATABASE and time.time() - session.get('lastWrite', 0) >= READ_AFTER_WRITE_SECONDS
+
+def get_user_data(username, replica_ok=False):
+    user = get_user_wrapper(username, replica_ok=replica_ok)
     if not user:
         return None
     
-    user_data = user['data'] if isinstance(user['data'], dict) else json.loads(user['data'])
-    
-    # Ensure categories exist
-    if 'categories' not in user_data:
-        old_tasks = user_data.get('dailyTasks', [])
-        user_data['categories'] = [
-            {
-                'name': 'General',
-                'icon': '📝',
-                'tasks': [
-                    {'text': task, 'completed': False, 'recurring': True}
-                    for task in old_tasks
-                ]
-            }
-        ]
-        if 'dailyTasks' in user_data:
-            del user_data['dailyTasks']
-        update_user_data_wrapper(username, user_data)
-    
-    # Ensure milestones array exists
-    if 'milestones' not in user_data:
-        user_data['milestones'] = []
+    user_data = document.load(user['data'])
     
-    # Ensure dailyMotivation exists and is current
-    if 'dailyMotivation' not in user_data or not is_today(user_data.get('dailyMotivation', {}).get('date')):
-        user_data['dailyMotivation'] = get_daily_motivation()
-        update_user_data_wrapper(username, user_data)
+    # Documents migrate_schema.py hasn't reached yet are upgraded in memory
+    # and stored upgraded with their next save. Steps that write elsewhere
+    # are left to that save: reads never write (and may hit a replica)
+    if not schema.is_current(user_data):
+        schema.upgrade(user_data)
     
     return user_data
 
-def save_user_data(username, data):
-    """Save user data and return success status"""
-    return update_user_data_wrapper(username, data)
+def save_user_data(username, data, resources=('*',), path=None, durable=False):
+    """Save user data and return success status
+    
+    Every save bumps the document's version so clients can tell which of two
+    copies is newer, and notifies the user's open event streams which
+    top-level sections changed ('*' for the whole document). durable=True
+    commits immediately even when the database runs in write-behind mode.
+    
+    The save only applies on top of the version data was loaded at; if
+    another request saved first, document.VersionConflict is raised (see
+    apply_operation for reloading and retrying).
+    """
+    # Finish the upgrade get_user_data left for the save
+    if not schema.is_current(data):
+        schema.upgrade(data, username)
+    
+    base_version = data.get('version', 0)
+    data['version'] = base_version + 1
+    try:
+        success = update_user_data_wrapper(username, data, base_version=base_version, durable=durable)
+    except document.VersionConflict:
+        data['version'] = base_version
+        raise
+    if success:
+        session['lastWrite'] = time.time()
+        for resource in resources:
+            events.publish(username, resource, path, data['version'])
+    return success
+
+def load_dashboard_data(user_id):
+    """Load the document for the dashboard, rolling the daily motivation if needed"""
+    replica_ok = replica_read_ok()
+    data = get_user_data(user_id, replica_ok=replica_ok)
+    if data is not None and replica_ok and needs_motivation_update(data):
+        # About to write back, so start from the primary's copy
+        data = get_user_data(user_id)
+    if data is None:
+        return None
+    data = check_streak_status(data)
+    
+    # Check if this is a new user (no quoteQueue yet). Without Gemini there is
+    # never a queue, and rolling on every load would bump the version each time
+    is_new_user = gemini_model is not None and data.is_empty('quoteQueue')
+    
+    if is_new_user:
+        print(f"🎉 New user detected! Generating initial quote queue...")
+        # Generate quotes for new user
+        data['dailyMotivation'] = get_next_motivation_from_queue(data)
+        print(f"🔍 Initial motivation set for new user")
+        save_motivation(user_id, data)
+    elif not is_today(data.get('dailyMotivation', {}).get('date')):
+        # Use queue system for daily motivation (existing user, new day)
+        data['dailyMotivation'] = get_next_motivation_from_queue(data)
+        print(f"🔍 Daily motivation on page load: {data['dailyMotivation']}")
+        save_motivation(user_id, data)
+    
+    return data
+
+def save_motivation(user_id, data):
+    try:
+        save_user_data(user_id, data, resources=('dailyMotivation',))
+    except document.VersionConflict:
+        # Another request saved first; the next load rolls the motivation again
+        print(f"⚠️ Motivation for {user_id} not saved, the document changed meanwhile")
+
+def needs_motivation_update(data):
+    """Whether load_dashboard_data will roll the motivation and save"""
+    is_new_user = gemini_model is not None and data.is_empty('quoteQueue')
+    return is_new_user or not is_today(data.get('dailyMotivation', {}).get('date'))
+
+# Fields only the server uses, never sent to the client
+BACKEND_ONLY_FIELDS = ('quoteQueue', 'queuePosition', 'stats', 'idSeq')
+
+def slim_user_data(data):
+    """Copy of the document without backend-only fields"""
+    return data.without(BACKEND_ONLY_FIELDS)
 
 def check_streak_status(data):
     if not data['lastCompletedDate']:
@@ -307,7 +582,7 @@ JSON format (NO markdown):
                 response_text = response_text[4:].strip()
         
         # Parse JSON
-        batch = json.loads(response_text)
+        batch = json_codec.loads(response_text)
         
         if not isinstance(batch, list) or len(batch) < 7:
             print(f"❌ Invalid batch: expected 10, got {len(batch) if isinstance(batch, list) else 'not a list'}")
@@ -405,12 +680,11 @@ def is_today(date_str):
 
 def get_daily_motivation():
     today = datetime.now().date()
-    random.seed(today.toordinal())
+    # Private generator: reseeding the global one would race with other threads
+    rng = random.Random(today.toordinal())
     
-    verse = random.choice(BIBLE_VERSES)
-    quote = random.choice(MOTIVATION_QUOTES)
-    
-    random.seed()
+    verse = rng.choice(BIBLE_VERSES)
+    quote = rng.choice(MOTIVATION_QUOTES)
     
     return {
         'bibleVerse': verse,
@@ -420,10 +694,299 @@ def get_daily_motivation():
 
 
 
+# Document operations
+# Each operation mutates a loaded document in place and raises OperationError
+# if the request is invalid. The single-action routes and /api/batch share them.
+# Items are addressed by ID (categoryId, taskId, milestoneId, habitId) or,
+# for older clients, by list position.
+MAX_BATCH_OPERATIONS = 100
+
+class OperationError(Exception):
+    """An operation was rejected; the message is returned to the client"""
+
+def get_index(params, key, items, error):
+    """Read a list index from params, raising OperationError if out of range"""
+    index = params.get(key)
+    if not isinstance(index, int) or isinstance(index, bool) or index < 0 or index >= len(items):
+        raise OperationError(error)
+    return index
+
+def id_index(data):
+    """ID -> (kind, list, item) index of data, built once per loaded document"""
+    cached = g.get('id_index')
+    if cached is None or cached[0] is not data:
+        cached = (data, item_ids.build_index(data))
+        g.id_index = cached
+    return cached[1]
+
+def get_item(data, params, kind, index_key, items, error):
+    """(list, item) addressed by params[kind + 'Id'] or params[index_key]"""
+    id_key = f"{kind}Id"
+    if id_key in params:
+        item_id = params[id_key]
+        entry = id_index(data).get(item_id) if isinstance(item_id, str) else None
+        if entry is None or entry[0] != kind:
+            raise OperationError(error)
+        return entry[1], entry[2]
+    return items, items[get_index(params, index_key, items, error)]
+
+def add_item(data, kind, items, item, sort_key=None):
+    """Add item to items under a new ID, returns its position
+    
+    Appended, or inserted in order if items is kept sorted by sort_key.
+    """
+    item['id'] = item_ids.new_id(data, kind)
+    item = document.record(kind, item)
+    position = len(items)
+    if sort_key is not None:
+        position = bisect.bisect_right(items, sort_key(item), key=sort_key)
+    items.insert(position, item)
+    id_index(data)[item['id']] = (kind, items, item)
+    return position
+
+def remove_item(data, items, item):
+    """Remove item (and any tasks it holds) from items and the ID index"""
+    for position, candidate in enumerate(items):
+        if candidate is item:
+            del items[position]
+            break
+    index = id_index(data)
+    index.pop(item.get('id'), None)
+    for task in item.get('tasks', []):
+        index.pop(task.get('id'), None)
+
+def op_add_category(data, params):
+    name = (params.get('name') or '').strip()
+    icon = (params.get('icon') or '📝').strip()
+    
+    if not name:
+        raise OperationError('Category name required')
+    
+    for cat in data['categories']:
+        if cat['name'].lower() == name.lower():
+            raise OperationError('Category already exists')
+    
+    index = add_item(data, 'category', data['categories'], {
+        'name': name,
+        'icon': icon,
+        'tasks': []
+    })
+    return {'index': index, 'id': data['categories'][index]['id']}
+
+def op_delete_category(data, params):
+    categories, category = get_item(data, params, 'category', 'index', data['categories'], 'Invalid category')
+    remove_item(data, categories, category)
+
+def op_add_task(data, params):
+    task_text = (params.get('task') or '').strip()
+    recurring = params.get('recurring', False)
+    
+    if ('categoryId' not in params and params.get('categoryIndex') is None) or not task_text:
+        raise OperationError('Category and task required')
+    
+    _, category = get_item(data, params, 'category', 'categoryIndex', data['categories'], 'Invalid category')
+    tasks = category['tasks']
+    task_index = add_item(data, 'task', tasks, {
+        'text': task_text,
+        'completed': False,
+        'recurring': recurring
+    })
+    return {
+        'categoryIndex': next(i for i, c in enumerate(data['categories']) if c is category),
+        'taskIndex': task_index,
+        'id': tasks[task_index]['id'],
+    }
+
+def get_task(data, params):
+    """(task list, task) addressed by taskId or categoryIndex/taskIndex"""
+    if 'taskId' in params:
+        return get_item(data, params, 'task', None, None, 'Invalid task')
+    category_index = get_index(params, 'categoryIndex', data['categories'], 'Invalid category')
+    tasks = data['categories'][category_index]['tasks']
+    return tasks, tasks[get_index(params, 'taskIndex', tasks, 'Invalid task')]
+
+def op_delete_task(data, params):
+    tasks, task = get_task(data, params)
+    remove_item(data, tasks, task)
+
+def op_toggle_task(data, params):
+    _, task = get_task(data, params)
+    task['completed'] = not task.get('completed', False)
+    return {'completed': task['completed']}
+
+def op_clear_all(data, params):
+    for category in data['categories']:
+        for task in category['tasks']:
+            task['completed'] = False
+
+def op_add_milestone(data, params):
+    text = (params.get('text') or '').strip()
+    target_date = params.get('targetDate')
+    milestone_type = params.get('type', 'milestone')
+    category = params.get('category', None)
+    priority = params.get('priority', 'medium')
+    
+    if not text or not target_date:
+        raise OperationError('Text and date required')
+    
+    milestone = {
+        'text': text,
+        'targetDate': target_date,
+        'completed': False,
+        'type': milestone_type,
+        'category': category,
+        'priority': priority
+    }
+    index = add_item(data, 'milestone', data['milestones'], milestone, sort_key=milestones.sort_key)
+    return {'index': index, 'id': milestone['id']}
+
+def op_delete_milestone(data, params):
+    items, milestone = get_item(data, params, 'milestone', 'index', data['milestones'], 'Invalid milestone')
+    remove_item(data, items, milestone)
+
+def op_toggle_milestone(data, params):
+    _, milestone = get_item(data, params, 'milestone', 'index', data['milestones'], 'Invalid milestone')
+    milestone['completed'] = not milestone.get('completed', False)
+    return {'completed': milestone['completed']}
+
+def op_add_habit(data, params):
+    name = (params.get('name') or '').strip()
+    clean_since = params.get('cleanSince')
+    
+    if not name or not clean_since:
+        raise OperationError('Name and start date required')
+    try:
+        habit_stats.parse_time(clean_since)
+    except (TypeError, ValueError):
+        raise OperationError('Invalid start date')
+    
+    index = add_item(data, 'habit', data.setdefault('badHabits', []), {
+        'name': name,
+        'cleanSince': clean_since,
+        'lastRelapseDate': None,
+        'longestStreak': 0,
+        'relapseCount': 0
+    })
+    return {'index': index, 'id': data['badHabits'][index]['id']}
+
+def op_delete_habit(data, params):
+    habits, habit = get_item(data, params, 'habit', 'index', data['badHabits'], 'Invalid habit index')
+    remove_item(data, habits, habit)
+
+def op_relapse(data, params):
+    _, habit = get_item(data, params, 'habit', 'habitIndex', data['badHabits'], 'Invalid habit index')
+    now = datetime.now()
+    
+    # The event itself is stored outside the document by record_operation_events
+    clean_days = habit_stats.days_since(habit.get('cleanSince'), now)
+    habit['longestStreak'] = max(habit.get('longestStreak', 0), clean_days)
+    habit['relapseCount'] = habit.get('relapseCount', 0) + 1
+    habit['lastRelapseDate'] = now.isoformat()
+    habit['cleanSince'] = now.isoformat()
+    return {'habit': habit['name'], 'cleanDays': clean_days, 'date': now.isoformat()}
+
+# Reloads and retries of an operation whose save lost a version race
+SAVE_ATTEMPTS = 3
+
+# Operation names accepted by /api/batch
+BATCH_OPERATIONS = {
+    'addCategory': op_add_category,
+    'deleteCategory': op_delete_category,
+    'addTask': op_add_task,
+    'deleteTask': op_delete_task,
+    'toggleTask': op_toggle_task,
+    'clearAllTasks': op_clear_all,
+    'addMilestone': op_add_milestone,
+    'deleteMilestone': op_delete_milestone,
+    'toggleMilestone': op_toggle_milestone,
+    'addHabit': op_add_habit,
+    'deleteHabit': op_delete_habit,
+    'relapse': op_relapse,
+}
+
+# Top-level document section each operation changes
+OPERATION_RESOURCES = {
+    op_add_category: 'categories',
+    op_delete_category: 'categories',
+    op_add_task: 'categories',
+    op_delete_task: 'categories',
+    op_toggle_task: 'categories',
+    op_clear_all: 'categories',
+    op_add_milestone: 'milestones',
+    op_delete_milestone: 'milestones',
+    op_toggle_milestone: 'milestones',
+    op_add_habit: 'badHabits',
+    op_delete_habit: 'badHabits',
+    op_relapse: 'badHabits',
+}
+
+def item_path(resource, params):
+    """Location of the item an operation addressed, e.g. categories/0/tasks/2"""
+    for key in ('taskId', 'categoryId', 'milestoneId', 'habitId'):
+        if key in params:
+            return f"{resource}/{params[key]}"
+    if 'categoryIndex' in params:
+        path = f"categories/{params['categoryIndex']}"
+        if 'taskIndex' in params:
+            path += f"/tasks/{params['taskIndex']}"
+        return path
+    if 'habitIndex' in params:
+        return f"badHabits/{params['habitIndex']}"
+    if 'index' in params:
+        return f"{resource}/{params['index']}"
+    return None
+
+def record_operation_events(user_id, applied):
+    """Store the events of saved operations that live outside the document
+    
+    applied is a list of (operation, result) pairs, in order.
+    """
+    for op, result in applied:
+        if op is op_relapse:
+            try:
+                habit_stats.record_relapse(
+                    user_id, result['habit'], datetime.fromisoformat(result['date']), result['cleanDays']
+                )
+            except Exception as e:
+                print(f"⚠️ Could not record relapse for {user_id}: {str(e)}")
+
+def apply_operation(op, params):
+    """Load the user's document, apply one operation and save it
+    
+    If another request saves the document in between, the operation is
+    applied again to the newer copy (up to SAVE_ATTEMPTS times).
+    """
+    user_id = session['user_id']
+    resource = OPERATION_RESOURCES[op]
+    for _ in range(SAVE_ATTEMPTS):
+        data = get_user_data(user_id)
+        
+        try:
+            result = op(data, params)
+        except OperationError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        try:
+            if not save_user_data(user_id, data, resources=(resource,), path=item_path(resource, params)):
+                return jsonify({'error': 'Failed to save data'}), 500
+        except document.VersionConflict:
+            continue
+        record_operation_events(user_id, [(op, result)])
+        return jsonify({'success': True, 'data': data})
+    raise document.VersionConflict(f"{user_id}'s document kept changing")
+
 @app.route('/')
 def index():
     if 'user_id' in session:
-        return render_template('dashboard.html', username=session['user_id'])
+        # Embed the document so the dashboard renders without a second request
+        data = load_dashboard_data(session['user_id'])
+        if data is not None:
+            return render_template(
+                'dashboard.html',
+                username=session['user_id'],
+                initial_data=slim_user_data(data)
+            )
+        session.pop('user_id', None)
     return render_template('login.html')
 
 @app.route('/test', methods=['GET'])
@@ -463,8 +1026,11 @@ def register():
             'dailyMotivation': get_daily_motivation(),
             'endGoal': '',
             'history': [],
-            'badHabits': []
+            'badHabits': [],
+            'schemaVersion': schema.CURRENT_SCHEMA_VERSION,
+            'version': 0
         }
+        item_ids.assign_ids(user_data)
         
         success = create_user_wrapper(username, passcode, user_data)
         
@@ -472,6 +1038,7 @@ def register():
             return jsonify({'error': 'Failed to create user'}), 500
         
         session['user_id'] = username
+        session['lastWrite'] = time.time()
         
         return jsonify({'success': True, 'username': username})
         
@@ -488,7 +1055,7 @@ def login():
         if not username or not passcode:
             return jsonify({'error': 'Username and passcode required'}), 400
         
-        user = get_user_wrapper(username)
+        user = get_user_wrapper(username, replica_ok=replica_read_ok())
         
         if not user or user['passcode'] != passcode:
             return jsonify({'error': 'Invalid credentials'}), 401
@@ -508,31 +1075,39 @@ def logout():
 @app.route('/api/data', methods=['GET'])
 @login_required
 def get_data():
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    data = check_streak_status(data)
-    
-    # Check if this is a new user (no quoteQueue yet)
-    is_new_user = 'quoteQueue' not in data or not data.get('quoteQueue')
+    data = slim_user_data(load_dashboard_data(session['user_id']))
     
-    if is_new_user:
-        print(f"🎉 New user detected! Generating initial quote queue...")
-        # Generate quotes for new user
-        data['dailyMotivation'] = get_next_motivation_from_queue(data)
-        print(f"🔍 Initial motivation set for new user")
-        save_user_data(user_id, data)
-    elif not is_today(data.get('dailyMotivation', {}).get('date')):
-        # Use queue system for daily motivation (existing user, new day)
-        data['dailyMotivation'] = get_next_motivation_from_queue(data)
-        print(f"🔍 Daily motivation on page load: {data['dailyMotivation']}")
-        save_user_data(user_id, data)
+    # ?fields=categories,milestones returns just those sections (after a change event)
+    fields = request.args.get('fields')
+    if fields:
+        wanted = set(fields.split(','))
+        data = data.only(wanted | {'version'})
     
     return jsonify(data)
 
+@app.route('/api/events', methods=['GET'])
+@login_required
+def stream_events():
+    """Server-sent change notifications for the logged-in user's document"""
+    user_id = session['user_id']
+    subscription = events.subscribe(user_id)
+    if subscription is None:
+        return jsonify({'error': 'Too many open event streams'}), 503, {'Retry-After': '60'}
+    
+    response = Response(events.stream(subscription), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.call_on_close(lambda: events.unsubscribe(user_id, subscription))
+    return response
+
 @app.route('/api/data', methods=['POST'])
 @login_required
 def save_data_endpoint():
-    """Save all user data at once - PRESERVES backend-only fields"""
+    """Save all user data at once - PRESERVES backend-only fields
+    
+    The document's version must be the stored version it was edited from,
+    otherwise the save is refused with 409 and the client reloads.
+    """
     try:
         user_id = session['user_id']
         new_data = request.json
@@ -540,15 +1115,30 @@ def save_data_endpoint():
         # Validate data structure
         if not isinstance(new_data, dict):
             return jsonify({'error': 'Invalid data format'}), 400
+        new_data = document.Document(new_data)
         
         # CRITICAL: Get existing data first to preserve backend-only fields!
         existing_data = get_user_data(user_id)
         
-        # Preserve backend-only fields (quoteQueue, queuePosition)
-        if 'quoteQueue' in existing_data:
-            new_data['quoteQueue'] = existing_data['quoteQueue']
-        if 'queuePosition' in existing_data:
-            new_data['queuePosition'] = existing_data['queuePosition']
+        # The client sends the version its copy is based on (documents that
+        # were never saved have none, which is version 0). If another device
+        # saved since, this copy would wipe out those edits: refuse it
+        stored_version = existing_data.get('version', 0)
+        if new_data.get('version', 0) != stored_version:
+            return jsonify({
+                'error': 'Your data was changed on another device',
+                'version': stored_version
+            }), 409
+        
+        # Preserve backend-only fields (quoteQueue, queuePosition, stats, idSeq)
+        for field in BACKEND_ONLY_FIELDS:
+            if field in existing_data:
+                new_data.take(existing_data, field)
+        
+        schema.upgrade(new_data)
+        # Items added on the client get their IDs here; send them back
+        ids_assigned = item_ids.assign_ids(new_data)
+        milestones.sort_milestones(new_data)
         
         print(f"💾 Saving with quoteQueue: {('quoteQueue' in new_data)}, pos: {new_data.get('queuePosition', 'N/A')}")
         
@@ -557,7 +1147,10 @@ def save_data_endpoint():
         
         if success:
             print(f"✅ Data saved successfully for user {user_id}")
-            return jsonify({'success': True, 'message': 'Data saved successfully'})
+            response = {'success': True, 'message': 'Data saved successfully', 'version': new_data['version']}
+            if ids_assigned:
+                response['data'] = slim_user_data(new_data)
+            return jsonify(response)
         else:
             print(f"❌ Save failed for user {user_id}")
             return jsonify({'error': 'Failed to save data'}), 500
@@ -567,6 +1160,7 @@ def save_data_endpoint():
 
 @app.route('/api/motivation/refresh', methods=['POST'])
 @login_required
+@expensive('motivation_refresh')
 def refresh_motivation():
     user_id = session['user_id']
     data = get_user_data(user_id)
@@ -586,7 +1180,7 @@ def refresh_motivation():
     else:
         print(f"   ⚠️ NO quoteQueue in data!")
     
-    save_user_data(user_id, data)
+    save_user_data(user_id, data, resources=('dailyMotivation',))
     
     # Return full data object so frontend stays in sync
     return jsonify({'success': True, 'data': data, 'motivation': data['dailyMotivation']})
@@ -634,11 +1228,16 @@ def complete_day():
     data['totalDaysCompleted'] += 1
     data['lastCompletedDate'] = datetime.now().isoformat()
     
-    data['history'].append({
+    data.append('history', {
         'date': datetime.now().isoformat(),
         'tasksCompleted': total_tasks,
         'streak': data['currentStreak']
     })
+    progress_stats.record_completion(data, today, data['currentStreak'], {
+        category['name']: len(category['tasks'])
+        for category in data['categories']
+        if category['tasks']
+    })
     
     for category in data['categories']:
         category['tasks'] = [
@@ -647,7 +1246,7 @@ def complete_day():
             if task.get('recurring', False)
         ]
     
-    save_user_data(user_id, data)
+    save_user_data(user_id, data, durable=True)
     
     return jsonify({
         'success': True,
@@ -658,210 +1257,255 @@ def complete_day():
 @app.route('/api/categories', methods=['POST'])
 @login_required
 def add_category():
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    category_data = request.json
-    name = category_data.get('name', '').strip()
-    icon = category_data.get('icon', '📝').strip()
-    
-    if not name:
-        return jsonify({'error': 'Category name required'}), 400
-    
-    for cat in data['categories']:
-        if cat['name'].lower() == name.lower():
-            return jsonify({'error': 'Category already exists'}), 400
-    
-    data['categories'].append({
-        'name': name,
-        'icon': icon,
-        'tasks': []
-    })
-    
-    save_user_data(user_id, data)
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_add_category, request.json or {})
 
 @app.route('/api/categories/<int:index>', methods=['DELETE'])
 @login_required
 def delete_category(index):
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    if index < 0 or index >= len(data['categories']):
-        return jsonify({'error': 'Invalid category'}), 400
-    
-    data['categories'].pop(index)
-    save_user_data(user_id, data)
-    
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_delete_category, {'index': index})
+
+@app.route('/api/categories/<category_id>', methods=['DELETE'])
+@login_required
+def delete_category_by_id(category_id):
+    return apply_operation(op_delete_category, {'categoryId': category_id})
 
 @app.route('/api/tasks', methods=['POST'])
 @login_required
 def add_task():
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    task_data = request.json
-    category_index = task_data.get('categoryIndex')
-    task_text = task_data.get('task', '').strip()
-    recurring = task_data.get('recurring', False)
-    
-    if category_index is None or not task_text:
-        return jsonify({'error': 'Category and task required'}), 400
-    
-    if category_index < 0 or category_index >= len(data['categories']):
-        return jsonify({'error': 'Invalid category'}), 400
-    
-    data['categories'][category_index]['tasks'].append({
-        'text': task_text,
-        'completed': False,
-        'recurring': recurring
-    })
-    
-    save_user_data(user_id, data)
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_add_task, request.json or {})
 
 @app.route('/api/tasks/<int:category_index>/<int:task_index>', methods=['DELETE'])
 @login_required
 def delete_task(category_index, task_index):
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    if category_index < 0 or category_index >= len(data['categories']):
-        return jsonify({'error': 'Invalid category'}), 400
-    
-    tasks = data['categories'][category_index]['tasks']
-    if task_index < 0 or task_index >= len(tasks):
-        return jsonify({'error': 'Invalid task'}), 400
-    
-    tasks.pop(task_index)
-    save_user_data(user_id, data)
-    
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_delete_task, {'categoryIndex': category_index, 'taskIndex': task_index})
 
 @app.route('/api/tasks/<int:category_index>/<int:task_index>/toggle', methods=['POST'])
 @login_required
 def toggle_task(category_index, task_index):
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    if category_index < 0 or category_index >= len(data['categories']):
-        return jsonify({'error': 'Invalid category'}), 400
-    
-    tasks = data['categories'][category_index]['tasks']
-    if task_index < 0 or task_index >= len(tasks):
-        return jsonify({'error': 'Invalid task'}), 400
-    
-    tasks[task_index]['completed'] = not tasks[task_index].get('completed', False)
-    
-    save_user_data(user_id, data)
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_toggle_task, {'categoryIndex': category_index, 'taskIndex': task_index})
+
+@app.route('/api/tasks/<task_id>', methods=['DELETE'])
+@login_required
+def delete_task_by_id(task_id):
+    return apply_operation(op_delete_task, {'taskId': task_id})
+
+@app.route('/api/tasks/<task_id>/toggle', methods=['POST'])
+@login_required
+def toggle_task_by_id(task_id):
+    return apply_operation(op_toggle_task, {'taskId': task_id})
 
 @app.route('/api/tasks/clear-all', methods=['POST'])
 @login_required
 def clear_all_checkboxes():
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    for category in data['categories']:
-        for task in category['tasks']:
-            task['completed'] = False
-    
-    save_user_data(user_id, data)
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_clear_all, {})
+
+@app.route('/api/milestones', methods=['GET'])
+@login_required
+def list_milestones():
+    """Milestones and deadlines in a date window, earliest first
+    
+    Query: from/to (YYYY-MM-DD, inclusive), type (milestone|deadline),
+    status (open|completed|overdue), limit (default 50, max 200) and
+    cursor (nextCursor from the previous page).
+    """
+    args = request.args
+    kind = args.get('type') or None
+    status = args.get('status') or None
+    if kind is not None and kind not in milestones.TYPES:
+        return jsonify({'error': f"type must be one of {', '.join(milestones.TYPES)}"}), 400
+    if status is not None and status not in milestones.STATUSES:
+        return jsonify({'error': f"status must be one of {', '.join(milestones.STATUSES)}"}), 400
+    try:
+        date_from = milestones.parse_date(args.get('from'))
+        date_to = milestones.parse_date(args.get('to'))
+        limit = int(args.get('limit', milestones.DEFAULT_LIMIT))
+        cursor = args.get('cursor') or None
+        if cursor is not None:
+            milestones.parse_cursor(cursor)
+    except ValueError:
+        return jsonify({'error': 'Invalid from, to, limit or cursor'}), 400
+    limit = max(1, min(limit, milestones.MAX_LIMIT))
+    
+    data = get_user_data(session['user_id'], replica_ok=replica_read_ok())
+    if data is None:
+        return jsonify({'error': 'User not found'}), 404
+    
+    page, next_cursor = milestones.query(
+        data['milestones'], datetime.now().date(),
+        date_from=date_from, date_to=date_to, kind=kind, status=status,
+        limit=limit, cursor=cursor
+    )
+    return jsonify({'milestones': page, 'nextCursor': next_cursor})
 
 @app.route('/api/milestones', methods=['POST'])
 @login_required
 def add_milestone():
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    milestone_data = request.json
-    text = milestone_data.get('text', '').strip()
-    target_date = milestone_data.get('targetDate')
-    milestone_type = milestone_data.get('type', 'milestone')
-    category = milestone_data.get('category', None)
-    priority = milestone_data.get('priority', 'medium')
-    
-    if not text or not target_date:
-        return jsonify({'error': 'Text and date required'}), 400
-    
-    if 'milestones' not in data:
-        data['milestones'] = []
-    
-    data['milestones'].append({
-        'text': text,
-        'targetDate': target_date,
-        'completed': False,
-        'type': milestone_type,
-        'category': category,
-        'priority': priority
-    })
-    
-    save_user_data(user_id, data)
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_add_milestone, request.json or {})
 
 @app.route('/api/milestones/<int:index>', methods=['DELETE'])
 @login_required
 def delete_milestone(index):
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    if 'milestones' not in data or index < 0 or index >= len(data['milestones']):
-        return jsonify({'error': 'Invalid milestone'}), 400
-    
-    data['milestones'].pop(index)
-    save_user_data(user_id, data)
-    
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_delete_milestone, {'index': index})
 
 @app.route('/api/milestones/<int:index>/toggle', methods=['POST'])
 @login_required
 def toggle_milestone(index):
-    user_id = session['user_id']
-    data = get_user_data(user_id)
-    
-    if 'milestones' not in data or index < 0 or index >= len(data['milestones']):
-        return jsonify({'error': 'Invalid milestone'}), 400
-    
-    data['milestones'][index]['completed'] = not data['milestones'][index].get('completed', False)
-    save_user_data(user_id, data)
-    
-    return jsonify({'success': True, 'data': data})
+    return apply_operation(op_toggle_milestone, {'index': index})
+
+@app.route('/api/milestones/<milestone_id>', methods=['DELETE'])
+@login_required
+def delete_milestone_by_id(milestone_id):
+    return apply_operation(op_delete_milestone, {'milestoneId': milestone_id})
+
+@app.route('/api/milestones/<milestone_id>/toggle', methods=['POST'])
+@login_required
+def toggle_milestone_by_id(milestone_id):
+    return apply_operation(op_toggle_milestone, {'milestoneId': milestone_id})
+
+@app.route('/api/bad-habits', methods=['POST'])
+@login_required
+def add_habit():
+    return apply_operation(op_add_habit, request.json or {})
+
+@app.route('/api/bad-habits/<int:index>', methods=['DELETE'])
+@login_required
+def delete_habit(index):
+    return apply_operation(op_delete_habit, {'index': index})
+
+@app.route('/api/bad-habits/<habit_id>', methods=['DELETE'])
+@login_required
+def delete_habit_by_id(habit_id):
+    return apply_operation(op_delete_habit, {'habitId': habit_id})
 
 @app.route('/api/bad-habits/relapse', methods=['POST'])
 @login_required
 def mark_relapse():
+    return apply_operation(op_relapse, request.json or {})
+
+@app.route('/api/bad-habits/<int:index>/relapse', methods=['POST'])
+@login_required
+def mark_relapse_by_index(index):
+    return apply_operation(op_relapse, {'habitIndex': index})
+
+@app.route('/api/bad-habits/<habit_id>/relapse', methods=['POST'])
+@login_required
+def mark_relapse_by_id(habit_id):
+    return apply_operation(op_relapse, {'habitId': habit_id})
+
+@app.route('/api/stats', methods=['GET'])
+@login_required
+def progress_stats_endpoint():
+    """Completion rates, per-category counts and streak distribution
+    
+    ?range=7|30|90|365 limits the completion rates to one window.
+    """
+    windows = progress_stats.WINDOWS
+    requested = request.args.get('range')
+    if requested:
+        if not requested.isdigit() or int(requested) not in progress_stats.WINDOWS:
+            allowed = ', '.join(str(window) for window in progress_stats.WINDOWS)
+            return jsonify({'error': f'range must be one of {allowed}'}), 400
+        windows = (int(requested),)
+    
+    data = get_user_data(session['user_id'], replica_ok=replica_read_ok())
+    if data is None:
+        return jsonify({'error': 'User not found'}), 404
+    data = check_streak_status(data)
+    return jsonify(progress_stats.report(data, datetime.now().date(), windows))
+
+@app.route('/api/bad-habits/stats', methods=['GET'])
+@login_required
+def bad_habit_stats():
+    """Clean streaks, relapse rates and monthly trend for each bad habit"""
     user_id = session['user_id']
-    data = get_user_data(user_id)
-    habit_index = request.json.get('habitIndex')
+    replica_ok = replica_read_ok()
+    data = get_user_data(user_id, replica_ok=replica_ok)
+    if data is None:
+        return jsonify({'error': 'User not found'}), 404
     
-    if habit_index < 0 or habit_index >= len(data['badHabits']):
-        return jsonify({'error': 'Invalid habit index'}), 400
+    now = datetime.now()
+    aggregates = habit_stats.relapse_aggregates(user_id, now, replica_ok=replica_ok)
+    return jsonify({
+        'habits': [
+            habit_stats.summarize(habit, aggregates.get(habit.get('name')), now)
+            for habit in data['badHabits']
+        ]
+    })
+
+@app.route('/api/leaderboard', methods=['GET'])
+@login_required
+def leaderboard_endpoint():
+    """Top users by streak or completed days
     
-    habit = data['badHabits'][habit_index]
+    ?metric=currentStreak|longestStreak|totalDaysCompleted (default
+    currentStreak), ?limit=1..50 (default 10).
+    """
+    metric = request.args.get('metric', 'currentStreak')
+    if metric not in leaderboard.METRICS:
+        return jsonify({'error': f"metric must be one of {', '.join(leaderboard.METRICS)}"}), 400
     
-    if 'relapses' not in habit:
-        habit['relapses'] = []
+    limit = request.args.get('limit', str(leaderboard.DEFAULT_LIMIT))
+    if not limit.isdigit() or not 1 <= int(limit) <= leaderboard.MAX_LIMIT:
+        return jsonify({'error': f'limit must be between 1 and {leaderboard.MAX_LIMIT}'}), 400
     
-    habit['relapses'].append({
-        'date': datetime.now().isoformat(),
-        'daysSober': habit['currentDaysClean']
+    today = datetime.now().date()
+    return jsonify({
+        'metric': metric,
+        'leaders': leaderboard.top(metric, int(limit), today),
+        'asOf': today.isoformat(),
     })
+
+@app.route('/api/batch', methods=['POST'])
+@login_required
+def batch_operations():
+    """Apply an ordered list of operations in one read-modify-write
     
-    if habit['currentDaysClean'] > habit['longestStreak']:
-        habit['longestStreak'] = habit['currentDaysClean']
+    Body: {"operations": [{"op": "toggleTask", "categoryIndex": 0, "taskIndex": 1}, ...]}
+    Parameters match the single-action routes. Either every operation is
+    applied and saved in a single write, or none are. The write is a
+    compare-and-set on the document version, so a concurrent save is never
+    overwritten: the batch is applied again to the newer copy instead.
+    """
+    payload = request.json
+    operations = payload.get('operations') if isinstance(payload, dict) else None
     
-    habit['currentDaysClean'] = 0
-    habit['lastRelapseDate'] = datetime.now().isoformat()
-    habit['cleanSince'] = datetime.now().isoformat()
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'Operations list required'}), 400
     
-    save_user_data(user_id, data)
+    if len(operations) > MAX_BATCH_OPERATIONS:
+        return jsonify({'error': f'At most {MAX_BATCH_OPERATIONS} operations per batch'}), 400
     
-    return jsonify({
-        'success': True,
-        'data': data
-    })
+    user_id = session['user_id']
+    for _ in range(SAVE_ATTEMPTS):
+        # A fresh copy each attempt, a rejected batch leaves nothing applied
+        data = get_user_data(user_id)
+        results = []
+        resources = []
+        applied = []
+        
+        for position, operation in enumerate(operations):
+            name = operation.get('op') if isinstance(operation, dict) else None
+            op = BATCH_OPERATIONS.get(name)
+            if op is None:
+                return jsonify({'error': f'Unknown operation: {name}', 'index': position}), 400
+            try:
+                results.append(op(data, operation) or {})
+                applied.append((op, results[-1]))
+            except OperationError as e:
+                return jsonify({'error': str(e), 'index': position, 'op': name}), 400
+            if OPERATION_RESOURCES[op] not in resources:
+                resources.append(OPERATION_RESOURCES[op])
+        
+        try:
+            if not save_user_data(user_id, data, resources=resources):
+                return jsonify({'error': 'Failed to save data'}), 500
+        except document.VersionConflict:
+            continue
+        record_operation_events(user_id, applied)
+        
+        print(f"✅ Applied batch of {len(operations)} operations for {user_id}")
+        return jsonify({'success': True, 'applied': len(operations), 'results': results, 'data': data})
+    raise document.VersionConflict(f"{user_id}'s document kept changing")
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
@@ -871,6 +1515,8 @@ if __name__ == '__main__':
 # Admin endpoint to manually generate quote queue (optional)
 @app.route('/api/admin/generate-quotes', methods=['POST'])
 @login_required
+@admin_required
+@expensive('generate_quotes')
 def admin_generate_quotes():
     """Manually trigger quote generation (for testing/admin)"""
     user_id = session['user_id']
@@ -881,7 +1527,8 @@ def admin_generate_quotes():
     if new_batch:
         data['quoteQueue'] = new_batch
         data['queuePosition'] = 0
-        save_user_data(user_id, data)
+        # The queue never reaches the client, nothing to announce
+        save_user_data(user_id, data, resources=())
         
         return jsonify({
             'success': True, 
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Move dormant users to compressed cold storage
+
+Users whose document hasn't been saved for --days (default ARCHIVE_AFTER_DAYS,
+90) leave the hot users table for users_archive, where the document is kept
+as zlib-compressed JSON. In JSON file mode they move from users_data.json to
+users_archive.json.z. The next time an archived user logs in (or anything
+looks them up) they are restored transparently.
+
+Safe to run while the app is serving (in JSON file mode it takes the same
+lock file as the app's saves); schedule it daily.
+
+Usage: python archive_users.py [--days N] [--dry-run]
+"""
+import sys
+from datetime import datetime, timedelta
+
+from app import USE_DATABASE, ARCHIVE_AFTER_DAYS, archive_dormant_file_users
+
+def parse_days(args):
+    if '--days' in args:
+        return int(args[args.index('--days') + 1])
+    return ARCHIVE_AFTER_DAYS
+
+def archive_database(days, dry_run):
+    from database import SHARDS, archive_user, dormant_usernames, table_size
+
+    cutoff = datetime.now() - timedelta(days=days)
+    total_users = total_json = total_packed = 0
+    for shard in SHARDS:
+        size_before = table_size(shard, 'users')
+        users = json_bytes = packed_bytes = 0
+        for username in list(dormant_usernames(shard, cutoff)):
+            if dry_run:
+                print(f"➡️ {username}")
+                users += 1
+                continue
+            sizes = archive_user(shard, username, cutoff)
+            if sizes:
+                users += 1
+                json_bytes += sizes[0]
+                packed_bytes += sizes[1]
+
+        print(f"📦 {shard['name']}: {users} users, documents {json_bytes:,} bytes -> {packed_bytes:,} compressed; "
+              f"users table {size_before:,} -> {table_size(shard, 'users'):,} bytes")
+        total_users += users
+        total_json += json_bytes
+        total_packed += packed_bytes
+
+    action = 'to archive' if dry_run else 'archived'
+    print(f"\n✅ Cold storage complete: {total_users} users {action}, "
+          f"{total_json - total_packed:,} bytes reclaimed")
+    if total_users and not dry_run:
+        print("ℹ️ Postgres reuses the freed space after VACUUM; VACUUM FULL users returns it to the OS")
+
+def archive_file(days, dry_run):
+    report = archive_dormant_file_users(days, dry_run=dry_run)
+    for username in report['users']:
+        print(f"➡️ {username}")
+
+    action = 'to archive' if dry_run else 'archived'
+    print(f"\n✅ Cold storage complete: {len(report['users'])} users {action}, "
+          f"users file {report['bytes_before']:,} -> {report['bytes_after']:,} bytes "
+          f"({report['bytes_before'] - report['bytes_after']:,} reclaimed), "
+          f"archive file {report['archive_bytes']:,} bytes")
+
+def main():
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    days = parse_days(args)
+    print(f"🧊 Archiving users inactive for {days} days{' (dry run)' if dry_run else ''}")
+
+    if USE_DATABASE:
+        archive_database(days, dry_run)
+    else:
+        archive_file(days, dry_run)
+
+if __name__ == '__main__':
+    main()
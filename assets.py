@@ -0,0 +1,51 @@
+"""
+Fingerprinted static assets
+
+build_assets.py writes minified, content-hashed copies of the CSS and JS to
+static/dist/ plus a manifest mapping each source name to its hashed file.
+Templates resolve assets through asset_url(), and hashed files are served
+with a far-future immutable Cache-Control since their names change whenever
+their content does.
+"""
+import os
+
+from flask import current_app, request, url_for
+
+import json_codec
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+def load_manifest(static_folder):
+    """Load the build manifest, or an empty one if assets were not built"""
+    path = os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json_codec.loads(f.read())
+    except (OSError, ValueError):
+        return {}
+
+def init_assets(app):
+    """Register asset_url() for templates and immutable caching for dist/"""
+    manifest = load_manifest(app.static_folder)
+    if manifest:
+        print(f"✅ Serving {len(manifest)} fingerprinted assets")
+
+    def asset_url(filename):
+        # In debug the sources are being edited, so always serve them directly.
+        # Checked per call: app.run(debug=True) sets debug after this module ran.
+        hashed = None if current_app.debug else manifest.get(filename)
+        return url_for('static', filename=hashed or filename)
+
+    def cache_hashed_assets(response):
+        filename = (request.view_args or {}).get('filename', '')
+        if request.endpoint == 'static' and filename.startswith(DIST_DIR + '/') and response.status_code == 200:
+            response.cache_control.no_cache = None
+            response.cache_control.public = True
+            response.cache_control.max_age = IMMUTABLE_MAX_AGE
+            response.cache_control.immutable = True
+        return response
+
+    app.jinja_env.globals['asset_url'] = asset_url
+    app.after_request(cache_hashed_assets)
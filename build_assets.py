@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Static asset build step
+
+For each CSS and JS file in static/:
+  - writes a minified, content-hashed copy to static/dist/ (e.g. app.3f2a9c1d04be.js)
+  - records it in static/dist/manifest.json, which templates resolve through
+  - precompresses both the source and the hashed copy (.br/.gz)
+
+Minification uses rcssmin/rjsmin when installed, otherwise a conservative
+whitespace and comment stripper.
+
+Usage: python build_assets.py
+"""
+import hashlib
+import os
+import re
+
+import json_codec
+from assets import DIST_DIR, MANIFEST_NAME
+from compression import ENCODINGS, compress
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+ASSET_EXTENSIONS = ('.css', '.js')
+HASH_LENGTH = 12
+
+def minify_css(source):
+    if rcssmin:
+        return rcssmin.cssmin(source)
+    source = re.sub(r'/\*.*?\*/', '', source, flags=re.S)
+    source = re.sub(r'\s+', ' ', source)
+    source = re.sub(r'\s*([{};,])\s*', r'\1', source)
+    return source.replace(';}', '}').strip()
+
+def minify_js(source):
+    if rjsmin:
+        return rjsmin.jsmin(source)
+    # Line based so automatic semicolon insertion is unaffected; lines inside
+    # template literals are copied as they are
+    lines = []
+    in_template = False
+    for line in source.splitlines():
+        if in_template:
+            lines.append(line)
+        else:
+            stripped = line.strip()
+            if stripped and not stripped.startswith('//'):
+                lines.append(stripped)
+        if len(re.findall(r'(?<!\\)`', line)) % 2:
+            in_template = not in_template
+    return '\n'.join(lines) + '\n'
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+def precompress(path):
+    """Write .br/.gz siblings of path, returning {encoding: size}"""
+    with open(path, 'rb') as f:
+        body = f.read()
+
+    sizes = {}
+    for encoding, ext in ENCODINGS:
+        compressed = compress(body, encoding, best=True)
+        with open(path + ext, 'wb') as f:
+            f.write(compressed)
+        sizes[encoding] = len(compressed)
+    return sizes
+
+def fingerprint(name, dist_dir):
+    """Write the minified, hashed copy of static/<name>, returning its file name"""
+    stem, ext = os.path.splitext(name)
+    with open(os.path.join(STATIC_DIR, name), 'r', encoding='utf-8') as f:
+        body = MINIFIERS[ext](f.read()).encode('utf-8')
+
+    digest = hashlib.sha256(body).hexdigest()[:HASH_LENGTH]
+    hashed_name = f"{stem}.{digest}{ext}"
+    with open(os.path.join(dist_dir, hashed_name), 'wb') as f:
+        f.write(body)
+    return hashed_name
+
+def main():
+    dist_dir = os.path.join(STATIC_DIR, DIST_DIR)
+    os.makedirs(dist_dir, exist_ok=True)
+
+    # Previous builds' hashed files are unreachable once the manifest changes
+    for old in os.listdir(dist_dir):
+        os.remove(os.path.join(dist_dir, old))
+
+    manifest = {}
+    for name in sorted(os.listdir(STATIC_DIR)):
+        if not name.endswith(ASSET_EXTENSIONS):
+            continue
+        path = os.path.join(STATIC_DIR, name)
+        hashed_name = fingerprint(name, dist_dir)
+        manifest[name] = f"{DIST_DIR}/{hashed_name}"
+        precompress(path)
+        hashed_path = os.path.join(dist_dir, hashed_name)
+        sizes = precompress(hashed_path)
+        summary = ', '.join(f"{encoding} {size:,}" for encoding, size in sizes.items())
+        print(f"✅ {name}: {os.path.getsize(path):,} bytes -> {hashed_name} "
+              f"{os.path.getsize(hashed_path):,} bytes ({summary})")
+
+    with open(os.path.join(dist_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        f.write(json_codec.dumps(manifest, indent=True))
+    print(f"✅ Wrote {DIST_DIR}/{MANIFEST_NAME} with {len(manifest)} assets")
+
+if __name__ == '__main__':
+    main()
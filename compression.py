@@ -0,0 +1,92 @@
+"""
+Response compression
+
+JSON and HTML responses above a size threshold (the dashboard page embeds
+the whole document) are compressed on the fly with brotli (when the brotli
+package is installed) or gzip, depending on what the client accepts. Static files are precompressed by build_assets.py and the .br/.gz
+sibling is served directly when it is present and up to date.
+"""
+import gzip
+import mimetypes
+import os
+
+from flask import request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', 1024))
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html'}
+
+# Preferred first; brotli only when we can produce it
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) if brotli else (('gzip', '.gz'),)
+
+def compress(body, encoding, best=False):
+    """Compress bytes; best=True trades CPU for size (used at build time)"""
+    if encoding == 'br':
+        return brotli.compress(body, quality=11 if best else 5)
+    return gzip.compress(body, compresslevel=9 if best else 6)
+
+def accepted_encodings():
+    """Encodings we can produce that the current request accepts, best first"""
+    return [(encoding, ext) for encoding, ext in ENCODINGS if request.accept_encodings[encoding] > 0]
+
+def compress_response(response):
+    """after_request hook compressing JSON and HTML bodies above COMPRESS_MIN_SIZE"""
+    if response.direct_passthrough or response.is_streamed:
+        return response
+    if response.status_code < 200 or response.status_code in (204, 304):
+        return response
+    if 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    encodings = accepted_encodings()
+    if not encodings:
+        return response
+
+    body = response.get_data()
+    if len(body) < COMPRESS_MIN_SIZE:
+        return response
+
+    encoding = encodings[0][0]
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    return response
+
+def precompressed_path(folder, filename, ext):
+    """Path of an up-to-date precompressed sibling of filename, or None"""
+    source = safe_join(folder, filename)
+    if source is None or not os.path.isfile(source):
+        return None
+    compressed = source + ext
+    if not os.path.isfile(compressed) or os.path.getmtime(compressed) < os.path.getmtime(source):
+        return None
+    return compressed
+
+def init_compression(app):
+    """Install response compression and precompressed static file serving on app"""
+    static_folder = app.static_folder
+
+    def send_static(filename):
+        for encoding, ext in accepted_encodings():
+            if precompressed_path(static_folder, filename, ext):
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                response = send_from_directory(
+                    static_folder, filename + ext,
+                    mimetype=mimetype,
+                    max_age=app.get_send_file_max_age(filename),
+                )
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+
+        response = app.send_static_file(filename)
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = send_static
+    app.after_request(compress_response)
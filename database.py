@@ -1,54 +1,381 @@
+import atexit
+import bisect
+import hashlib
+import heapq
 import os
+import random
+import threading
+import time
 import psycopg2
-from psycopg2.extras import RealDictCursor
-import json
+from psycopg2.extras import RealDictCursor, Json, execute_values, register_default_json, register_default_jsonb
+from psycopg2.pool import PoolError, ThreadedConnectionPool
 from datetime import datetime
+import document
+import json_codec
+import schema
 
 DATABASE_URL = os.environ.get('DATABASE_URL')
 
-def get_db_connection():
-    """Get database connection"""
-    conn = psycopg2.connect(DATABASE_URL, cursor_factory=RealDictCursor)
+# JSONB columns are decoded by psycopg2 itself, route that through our codec
+register_default_json(loads=json_codec.loads, globally=True)
+register_default_jsonb(loads=json_codec.loads, globally=True)
+
+def to_jsonb(data):
+    """Adapt a document for a JSONB parameter, encoded with our codec"""
+    return Json(data, dumps=json_codec.dumps)
+
+# Connections are shared by the threads of one gunicorn worker. The worker
+# has more threads than the pool has connections (event streams and the
+# write-behind flusher get threads of their own, see gunicorn.conf.py), so a
+# thread that finds every connection in use waits up to DB_POOL_TIMEOUT
+# seconds for one instead of failing.
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', os.environ.get('GUNICORN_THREADS', 4)))
+DB_POOL_TIMEOUT = float(os.environ.get('DB_POOL_TIMEOUT', 10))
+
+# Optional read replicas (comma-separated DSNs). Pure reads go to a healthy
+# replica; writes, and reads for a user who wrote in the last
+# READ_AFTER_WRITE_SECONDS, stay on the primary.
+DATABASE_REPLICA_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+]
+READ_AFTER_WRITE_SECONDS = float(os.environ.get('READ_AFTER_WRITE_SECONDS', 5))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+REPLICA_CHECK_SECONDS = 5
+REPLICA_RETRY_SECONDS = 30
+
+# Optional write-behind: with WRITE_BEHIND_MS > 0, document updates are kept
+# in a per-user buffer (latest version wins) and flushed every WRITE_BEHIND_MS
+# as one multi-row UPDATE per shard, so a burst of toggles costs one commit.
+# Up to WRITE_BEHIND_MS of updates can be lost if the process dies. Pass
+# durable=True to update_user_data for writes that must be committed before
+# responding. The buffer lives in one process and other workers would read
+# and overwrite stale rows, so it needs a single worker (WEB_CONCURRENCY=1).
+WRITE_BEHIND_MS = int(os.environ.get('WRITE_BEHIND_MS', 0))
+if WRITE_BEHIND_MS > 0 and os.environ.get('WEB_CONCURRENCY', '').strip() != '1':
+    print("⚠️ WRITE_BEHIND_MS needs WEB_CONCURRENCY=1 (the buffer is per process), write-behind disabled")
+    WRITE_BEHIND_MS = 0
+
+# Optional sharding: DATABASE_SHARD_URLS lists every shard's primary
+# (comma-separated). Users are placed by consistent hashing of the username.
+# A shard's identity is its position, so add new shards at the end and run
+# rebalance_shards.py; shard i's replicas come from DATABASE_SHARD_<i>_REPLICA_URLS.
+DATABASE_SHARD_URLS = [
+    url.strip() for url in os.environ.get('DATABASE_SHARD_URLS', '').split(',') if url.strip()
+]
+SHARD_VNODES = 64
+# While users are being moved between shards, look for them on every shard
+SHARD_REBALANCING = os.environ.get('SHARD_REBALANCING', '').strip().lower() in ('1', 'true', 'yes')
+
+def split_urls(value):
+    return [url.strip() for url in value.split(',') if url.strip()]
+
+def load_shards():
+    """[{'name', 'primary', 'replicas'}] from the environment"""
+    if not DATABASE_SHARD_URLS:
+        return [{'name': 'shard-0', 'primary': DATABASE_URL, 'replicas': DATABASE_REPLICA_URLS}]
+    return [
+        {
+            'name': f'shard-{i}',
+            'primary': url,
+            'replicas': split_urls(os.environ.get(f'DATABASE_SHARD_{i}_REPLICA_URLS', '')),
+        }
+        for i, url in enumerate(DATABASE_SHARD_URLS)
+    ]
+
+def build_ring(shards):
+    """Consistent-hash ring: sorted (point, shard index) with SHARD_VNODES points per shard"""
+    return sorted(
+        (hash_key(f"{shard['name']}#{vnode}"), i)
+        for i, shard in enumerate(shards)
+        for vnode in range(SHARD_VNODES)
+    )
+
+def hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+SHARDS = load_shards()
+_ring = build_ring(SHARDS)
+_ring_points = [point for point, _ in _ring]
+
+def shard_for(username):
+    """The shard a username lives on"""
+    position = bisect.bisect(_ring_points, hash_key(username)) % len(_ring)
+    return SHARDS[_ring[position][1]]
+
+_pools = {}
+_pool_lock = threading.Lock()
+_pool_slots = {}  # pool -> semaphore counting its free connections
+_connection_pools = {}
+
+def get_pool(dsn=None):
+    """Get the per-process connection pool for dsn, creating it on first use.
+
+    Created lazily so each forked gunicorn worker gets its own sockets.
+    """
+    dsn = dsn or DATABASE_URL
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pool_lock:
+            pool = _pools.get(dsn)
+            if pool is None:
+                pool = ThreadedConnectionPool(
+                    DB_POOL_MIN, DB_POOL_MAX, dsn, cursor_factory=RealDictCursor
+                )
+                _pool_slots[pool] = threading.BoundedSemaphore(DB_POOL_MAX)
+                _pools[dsn] = pool
+    return pool
+
+def get_db_connection(dsn=None):
+    """Get database connection from the pool (the primary unless dsn is given)
+    
+    Waits up to DB_POOL_TIMEOUT seconds while the pool is exhausted.
+    """
+    pool = get_pool(dsn)
+    slots = _pool_slots[pool]
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        raise PoolError(f"No free database connection after {DB_POOL_TIMEOUT}s")
+    try:
+        conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+    _connection_pools[conn] = pool
     return conn
 
-def init_db():
-    """Initialize database tables"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+def release_db_connection(conn):
+    """Return a connection to its pool, discarding it if it is broken"""
+    pool = _connection_pools.pop(conn)
+    try:
+        pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        _pool_slots[pool].release()
+
+# Read routing
+_last_write = {}  # username -> time.monotonic() of this process's last write
+_replica_health = {}  # dsn -> {'lag', 'checked', 'down_until'}
+
+def mark_written(username):
+    """Record a write so this user's reads stick to the primary for a while"""
+    _last_write[username] = time.monotonic()
+
+def written_recently(username):
+    last = _last_write.get(username)
+    return last is not None and time.monotonic() - last < READ_AFTER_WRITE_SECONDS
+
+def mark_replica_down(dsn):
+    health = _replica_health.setdefault(dsn, {'lag': 0.0, 'checked': 0.0, 'down_until': 0.0})
+    health['down_until'] = time.monotonic() + REPLICA_RETRY_SECONDS
+    print(f"⚠️ DATABASE: Replica unavailable, reading from primary for {REPLICA_RETRY_SECONDS}s")
+
+def replica_lag(dsn):
+    """Seconds the replica is behind, re-measured every REPLICA_CHECK_SECONDS"""
+    health = _replica_health.setdefault(dsn, {'lag': 0.0, 'checked': 0.0, 'down_until': 0.0})
+    now = time.monotonic()
+    if now - health['checked'] >= REPLICA_CHECK_SECONDS:
+        conn = get_db_connection(dsn)
+        try:
+            cur = conn.cursor()
+            # Fully replayed replicas report 0 even if the primary has been idle
+            cur.execute('''
+                SELECT CASE
+                    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+                    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+                END AS lag
+            ''')
+            health['lag'] = float(cur.fetchone()['lag'])
+            health['checked'] = now
+            cur.close()
+        finally:
+            release_db_connection(conn)
+    return health['lag']
+
+def choose_replica(replicas):
+    """One of replicas that is up and within REPLICA_MAX_LAG_SECONDS, or None"""
+    now = time.monotonic()
+    for dsn in random.sample(replicas, len(replicas)):
+        if _replica_health.get(dsn, {}).get('down_until', 0) > now:
+            continue
+        try:
+            if replica_lag(dsn) <= REPLICA_MAX_LAG_SECONDS:
+                return dsn
+        except psycopg2.Error:
+            mark_replica_down(dsn)
+    return None
+
+def run_read(shard, query, params, fetch_all=False, username=None, replica_ok=True):
+    """Run a read-only query on shard, on one of its replicas when routing allows it
     
-    # Create users table
-    cur.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            username VARCHAR(255) PRIMARY KEY,
-            passcode VARCHAR(4) NOT NULL,
-            created TIMESTAMP NOT NULL,
-            data JSONB NOT NULL
-        )
-    ''')
+    Falls back to the primary if the replica fails mid-query.
+    """
+    dsn = None
+    if replica_ok and shard['replicas'] and not (username and written_recently(username)):
+        dsn = choose_replica(shard['replicas'])
     
-    conn.commit()
-    cur.close()
-    conn.close()
-    print("Database initialized successfully")
+    try:
+        conn = get_db_connection(dsn or shard['primary'])
+        try:
+            cur = conn.cursor()
+            cur.execute(query, params)
+            result = cur.fetchall() if fetch_all else cur.fetchone()
+            cur.close()
+        finally:
+            release_db_connection(conn)
+    except psycopg2.OperationalError:
+        if dsn is None:
+            raise
+        mark_replica_down(dsn)
+        return run_read(shard, query, params, fetch_all, username, replica_ok=False)
+    return result
 
-def get_user(username):
-    """Get user by username"""
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute('SELECT * FROM users WHERE username = %s', (username,))
-    user = cur.fetchone()
+# Document fields promoted to indexed columns: metric -> (column, expression)
+LEADERBOARD_COLUMNS = {
+    'currentStreak': ('current_streak', "COALESCE((data->>'currentStreak')::numeric::int, 0)"),
+    'longestStreak': ('longest_streak', "COALESCE((data->>'longestStreak')::numeric::int, 0)"),
+    'totalDaysCompleted': ('total_days', "COALESCE((data->>'totalDaysCompleted')::numeric::int, 0)"),
+}
+
+# pg_advisory_xact_lock key serializing schema changes across processes
+SCHEMA_LOCK_KEY = 7243019
+
+def init_db():
+    """Initialize database tables on every shard
     
-    cur.close()
-    conn.close()
+    Run once per deploy (gunicorn's on_starting hook, see gunicorn.conf.py),
+    not per worker. Columns and indexes that already exist are skipped
+    without touching the table: ALTER TABLE takes an ACCESS EXCLUSIVE lock
+    even when there is nothing to add, which would queue every user query
+    behind any long transaction on users.
+    """
+    for shard in SHARDS:
+        init_shard(shard)
+    print("Database initialized successfully")
+
+def close_pools():
+    """Close every pooled connection, e.g. before gunicorn forks its workers"""
+    with _pool_lock:
+        for pool in _pools.values():
+            pool.closeall()
+        _pools.clear()
+        _pool_slots.clear()
+
+def init_shard(shard):
+    conn = get_db_connection(shard['primary'])
+    try:
+        cur = conn.cursor()
+        # Concurrent runs (several instances booting) take turns
+        cur.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK_KEY,))
+        
+        # Create users table
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                username VARCHAR(255) PRIMARY KEY,
+                passcode VARCHAR(4) NOT NULL,
+                created TIMESTAMP NOT NULL,
+                data JSONB NOT NULL
+            )
+        ''')
+        
+        cur.execute('''
+            SELECT column_name FROM information_schema.columns
+            WHERE table_schema = current_schema() AND table_name = 'users'
+        ''')
+        columns = {row['column_name'] for row in cur.fetchall()}
+        cur.execute('SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()')
+        indexes = {row['indexname'] for row in cur.fetchall()}
+        
+        # Existing rows count as active from the moment the column is added
+        if 'last_active' not in columns:
+            cur.execute('''
+                ALTER TABLE users ADD COLUMN last_active TIMESTAMP NOT NULL DEFAULT NOW()
+            ''')
+        if 'users_last_active_idx' not in indexes:
+            cur.execute('CREATE INDEX users_last_active_idx ON users (last_active)')
+        
+        # Leaderboard fields as generated columns, indexed for top-K scans
+        for column, expression in LEADERBOARD_COLUMNS.values():
+            if column not in columns:
+                cur.execute(f'''
+                    ALTER TABLE users ADD COLUMN {column} INTEGER
+                    GENERATED ALWAYS AS ({expression}) STORED
+                ''')
+            if f'users_{column}_idx' not in indexes:
+                cur.execute(f'CREATE INDEX users_{column}_idx ON users ({column} DESC, username)')
+        if 'last_completed' not in columns:
+            cur.execute('''
+                ALTER TABLE users ADD COLUMN last_completed TEXT
+                GENERATED ALWAYS AS (LEFT(data->>'lastCompletedDate', 10)) STORED
+            ''')
+        
+        # Create relapse event table (see habit_stats.py)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS relapses (
+                id BIGSERIAL PRIMARY KEY,
+                username VARCHAR(255) NOT NULL,
+                habit VARCHAR(255) NOT NULL,
+                occurred TIMESTAMP NOT NULL,
+                clean_days INTEGER NOT NULL
+            )
+        ''')
+        if 'relapses_username_idx' not in indexes:
+            cur.execute('CREATE INDEX relapses_username_idx ON relapses (username, habit, occurred)')
+        
+        # Create cold storage table (data is json_codec.pack()ed)
+        cur.execute('''
+            CREATE TABLE IF NOT EXISTS users_archive (
+                username VARCHAR(255) PRIMARY KEY,
+                passcode VARCHAR(4) NOT NULL,
+                created TIMESTAMP NOT NULL,
+                last_active TIMESTAMP NOT NULL,
+                archived TIMESTAMP NOT NULL,
+                data BYTEA NOT NULL
+            )
+        ''')
+        
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+# document.LAZY_SECTIONS come back as JSON text, decoded only if they are used
+USER_QUERY = '''
+    SELECT username, passcode, created, last_active, data - %s::text[] AS data, {}
+    FROM users WHERE username = %s
+'''.format(', '.join(f"(data->'{section}')::text AS \"{section}\"" for section in document.LAZY_SECTIONS))
+
+def get_user(username, replica_ok=False):
+    """Get user by username, data as a document.Document
     
-    return dict(user) if user else None
+    replica_ok=True allows a read replica (pure reads that won't be written back).
+    """
+    shard = shard_for(username)
+    # Checked before reading the row: a flush committing in between then
+    # leaves us with either its buffered copy or the committed row
+    buffered = buffered_data(username)
+    user = run_read(
+        shard, USER_QUERY, (list(document.LAZY_SECTIONS), username),
+        username=username, replica_ok=replica_ok
+    )
+    if user is None and SHARD_REBALANCING and locate_and_move(username, shard):
+        return get_user(username)
+    if user is None and replica_ok:
+        # The replica may not have the row yet; only the primary can say it's missing
+        return get_user(username)
+    if user is None:
+        return restore_archived_user(username, shard)
+    user = dict(user)
+    raw = {section: user.pop(section) for section in document.LAZY_SECTIONS}
+    user['data'] = document.Document(user['data'], raw=raw)
+    if buffered is not None:
+        user['data'] = buffered
+    return user
 
 def create_user(username, passcode, data):
     """Create new user with comprehensive error handling"""
+    conn = None
     try:
         print(f"📊 DATABASE: Opening connection for user creation: {username}")
-        conn = get_db_connection()
+        conn = get_db_connection(shard_for(username)['primary'])
         print(f"📊 DATABASE: Connection opened successfully")
         cur = conn.cursor()
         
@@ -56,20 +383,18 @@ def create_user(username, passcode, data):
             print(f"📊 DATABASE: Executing INSERT for user: {username}")
             cur.execute(
                 'INSERT INTO users (username, passcode, created, data) VALUES (%s, %s, %s, %s)',
-                (username, passcode, datetime.now(), json.dumps(data))
+                (username, passcode, datetime.now(), to_jsonb(data))
             )
             print(f"📊 DATABASE: INSERT executed, committing...")
             conn.commit()
+            mark_written(username)
             print(f"📊 DATABASE: Commit successful for user: {username}")
             cur.close()
-            conn.close()
-            print(f"📊 DATABASE: Connection closed")
             return True
         except psycopg2.IntegrityError as ie:
             print(f"❌ DATABASE: IntegrityError (user already exists): {str(ie)}")
             conn.rollback()
             cur.close()
-            conn.close()
             return False
     except psycopg2.OperationalError as oe:
         print(f"❌ DATABASE: OperationalError (connection/database issue): {str(oe)}")
@@ -80,35 +405,587 @@ def create_user(username, passcode, data):
         print(f"❌ DATABASE: Full traceback: {traceback.format_exc()}")
         try:
             conn.rollback()
-            cur.close()
-            conn.close()
         except:
             pass
         return False
+    finally:
+        if conn is not None:
+            release_db_connection(conn)
+            print(f"📊 DATABASE: Connection returned to pool")
 
-def update_user_data(username, data):
-    """Update user data"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+def update_user_data(username, data, base_version=None, durable=False):
+    """Update user data
     
-    cur.execute(
-        'UPDATE users SET data = %s WHERE username = %s',
-        (json.dumps(data), username)
-    )
+    With base_version, the update only applies if the stored document is
+    still that version (compare-and-set), otherwise document.VersionConflict
+    is raised. In write-behind mode the update is buffered unless durable=True.
+    """
+    if WRITE_BEHIND_MS > 0:
+        if not durable:
+            buffer_write(username, data, base_version)
+            return
+        # Hold off the flusher and other writers so the buffered copy we
+        # replace can't land after us or be replaced meanwhile
+        with _flush_lock, _buffer_lock:
+            entry = _write_buffer.get(username)
+            if entry is not None:
+                base_version = _buffered_base(username, entry, base_version)
+            write_user_data(username, data, base_version)
+            _write_buffer.pop(username, None)
+        return
+    write_user_data(username, data, base_version)
+
+def write_user_data(username, data, base_version=None):
+    """UPDATE the row (compare-and-set with base_version), False if there is none"""
+    shard = shard_for(username)
+    conn = get_db_connection(shard['primary'])
+    try:
+        cur = conn.cursor()
+        if base_version is None:
+            cur.execute(
+                'UPDATE users SET data = %s, last_active = NOW() WHERE username = %s',
+                (to_jsonb(data), username)
+            )
+        else:
+            cur.execute('''
+                UPDATE users SET data = %s, last_active = NOW()
+                WHERE username = %s AND COALESCE((data->>'version')::int, 0) = %s
+            ''', (to_jsonb(data), username, base_version))
+        updated = cur.rowcount
+        exists = updated > 0
+        if not exists:
+            cur.execute('SELECT 1 FROM users WHERE username = %s', (username,))
+            exists = cur.fetchone() is not None
+        conn.commit()
+        if updated:
+            mark_written(username)
+        cur.close()
+    finally:
+        release_db_connection(conn)
     
-    conn.commit()
-    cur.close()
-    conn.close()
+    if not updated and exists:
+        raise document.VersionConflict(f"{username}'s document is newer than version {base_version}")
+    # Mid-rebalance the row may still be on its old shard: move it, then retry
+    if not updated and SHARD_REBALANCING and locate_and_move(username, shard):
+        return write_user_data(username, data, base_version)
+    return updated > 0
+
+# Write-behind buffer
+
+# username -> (stored version it applies to, its version, encoded document).
+# Documents are buffered encoded, so later edits to the request's object
+# can't leak in, and every reader decodes its own copy.
+_write_buffer = {}
+_flushing = {}  # entries taken by a flush that hasn't committed yet
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+_flusher_started = False
+
+def _buffered_base(username, entry, base_version):
+    """Stored version an update on top of a buffered entry applies to"""
+    stored_base, buffered_version, _ = entry
+    if base_version is not None and base_version != buffered_version:
+        raise document.VersionConflict(f"{username}'s buffered document is newer than version {base_version}")
+    return stored_base
+
+def buffer_write(username, data, base_version=None):
+    global _flusher_started
+    encoded = json_codec.dumps(data)
+    with _buffer_lock:
+        entry = _write_buffer.get(username)
+        if entry is not None:
+            base_version = _buffered_base(username, entry, base_version)
+        _write_buffer[username] = (base_version, data.get('version'), encoded)
+        start = not _flusher_started
+        _flusher_started = True
+    mark_written(username)
+    if start:
+        threading.Thread(target=_flush_loop, name='write-behind', daemon=True).start()
+
+def buffered_data(username):
+    """A copy of the unflushed document for username, or None"""
+    with _buffer_lock:
+        entry = _write_buffer.get(username) or _flushing.get(username)
+    if entry is None:
+        return None
+    return document.load(json_codec.loads(entry[2]))
+
+def _flush_loop():
+    while True:
+        time.sleep(WRITE_BEHIND_MS / 1000)
+        try:
+            flush_write_buffer()
+        except Exception as e:
+            print(f"⚠️ Write-behind flush failed, will retry: {str(e)}")
+
+def flush_write_buffer():
+    """Commit every buffered document, one multi-row UPDATE per shard"""
+    global _write_buffer
+    with _flush_lock:
+        with _buffer_lock:
+            pending, _write_buffer = _write_buffer, {}
+            _flushing.update(pending)
+        if not pending:
+            return 0
+        
+        try:
+            by_shard = {}
+            for username, entry in pending.items():
+                by_shard.setdefault(shard_for(username)['name'], []).append((username, entry))
+            
+            flushed = 0
+            missing = []
+            try:
+                for shard in SHARDS:
+                    rows = by_shard.pop(shard['name'], None)
+                    if not rows:
+                        continue
+                    updated = _flush_shard(shard, rows)
+                    flushed += len(updated)
+                    missing.extend((username, entry) for username, entry in rows if username not in updated)
+            except Exception:
+                # Keep whatever hasn't been committed, unless a newer copy arrived
+                with _buffer_lock:
+                    for shard_rows in by_shard.values():
+                        for username, entry in shard_rows:
+                            _requeue(username, entry)
+                raise
+            
+            # The row is gone, was changed by someone else (e.g. a script),
+            # or mid-rebalance is still on its old shard
+            for username, (base_version, _, encoded) in missing:
+                try:
+                    if write_user_data(username, json_codec.loads(encoded), base_version):
+                        flushed += 1
+                    else:
+                        print(f"⚠️ Write-behind: user {username} no longer exists, update dropped")
+                except document.VersionConflict:
+                    print(f"❌ Write-behind: {username} changed in the database since it was buffered, update dropped")
+                    with _buffer_lock:
+                        _write_buffer.pop(username, None)
+            return flushed
+        finally:
+            with _buffer_lock:
+                _flushing.clear()
+
+def _requeue(username, entry):
+    """Put a failed flush entry back, under any newer update buffered since"""
+    newer = _write_buffer.get(username)
+    if newer is None:
+        _write_buffer[username] = entry
+    else:
+        # The newer update was made on top of this one, commit both at once
+        _write_buffer[username] = (entry[0], newer[1], newer[2])
+
+def _flush_shard(shard, rows):
+    conn = get_db_connection(shard['primary'])
+    try:
+        cur = conn.cursor()
+        try:
+            # Compare-and-set: a row whose version moved on is left alone
+            updated = execute_values(cur, """
+                UPDATE users SET data = v.data::jsonb, last_active = NOW()
+                FROM (VALUES %s) AS v(username, base, data)
+                WHERE users.username = v.username
+                  AND (v.base IS NULL OR COALESCE((users.data->>'version')::int, 0) = v.base::int)
+                RETURNING users.username
+            """, [(username, base_version, encoded) for username, (base_version, _, encoded) in rows], fetch=True)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            with _buffer_lock:
+                for username, entry in rows:
+                    _requeue(username, entry)
+            raise
+        finally:
+            cur.close()
+    finally:
+        release_db_connection(conn)
+    return {row['username'] for row in updated}
+
+atexit.register(flush_write_buffer)
 
 def get_all_users():
-    """Get all users (for migration)"""
-    conn = get_db_connection()
-    cur = conn.cursor()
+    """Get all users from every shard (for migration)"""
+    flush_write_buffer()
+    users = []
+    for shard in SHARDS:
+        users.extend(run_read(shard, 'SELECT * FROM users', (), fetch_all=True))
     
-    cur.execute('SELECT * FROM users')
-    users = cur.fetchall()
+    return [dict(user) for user in users]
+
+# Schema migration
+
+def upgrade_shard_documents(shard, batch_size=500, dry_run=False):
+    """Upgrade every outdated document on shard, one transaction per batch
     
-    cur.close()
-    conn.close()
+    Returns the number of documents upgraded (or found outdated, for dry_run).
+    """
+    upgraded = 0
+    last = ''
+    while True:
+        conn = get_db_connection(shard['primary'])
+        try:
+            cur = conn.cursor()
+            # Lock the batch so a concurrent save waits instead of being overwritten
+            cur.execute('''
+                SELECT username, data FROM users
+                WHERE username > %s AND COALESCE((data->>'schemaVersion')::int, 0) < %s
+                ORDER BY username LIMIT %s
+                FOR UPDATE
+            ''', (last, schema.CURRENT_SCHEMA_VERSION, batch_size))
+            rows = cur.fetchall()
+            if not rows:
+                conn.rollback()
+                return upgraded
+            
+            for row in rows:
+                schema.upgrade(row['data'], None if dry_run else row['username'])
+            if dry_run:
+                conn.rollback()
+            else:
+                execute_values(cur, """
+                    UPDATE users SET data = v.data::jsonb
+                    FROM (VALUES %s) AS v(username, data)
+                    WHERE users.username = v.username
+                """, [(row['username'], to_jsonb(row['data'])) for row in rows])
+                conn.commit()
+            cur.close()
+        finally:
+            release_db_connection(conn)
+        
+        upgraded += len(rows)
+        last = rows[-1]['username']
+        print(f"📊 DATABASE: {shard['name']}: {upgraded} outdated documents processed")
+
+# Habit analytics
+
+def record_relapse(username, habit, occurred, clean_days):
+    """Insert one relapse event on the user's shard"""
+    conn = get_db_connection(shard_for(username)['primary'])
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            'INSERT INTO relapses (username, habit, occurred, clean_days) VALUES (%s, %s, %s, %s)',
+            (username, habit, occurred, clean_days)
+        )
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+def import_relapses(username, habit, events):
+    """Insert the (occurred, clean_days) events of habit that aren't stored yet"""
+    conn = get_db_connection(shard_for(username)['primary'])
+    try:
+        cur = conn.cursor()
+        execute_values(cur, '''
+            INSERT INTO relapses (username, habit, occurred, clean_days)
+            SELECT v.username, v.habit, v.occurred, v.clean_days
+            FROM (VALUES %s) AS v(username, habit, occurred, clean_days)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM relapses r
+                WHERE r.username = v.username AND r.habit = v.habit AND r.occurred = v.occurred
+            )
+        ''', [(username, habit, occurred, clean_days) for occurred, clean_days in events])
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+def relapse_aggregates(username, windows, months, replica_ok=False):
+    """Per-habit relapse aggregates for habit_stats, computed in SQL
+    
+    windows are day counts for the relapse rate columns; monthly counts
+    cover the last months months, each with a 3-month rolling average.
+    """
+    shard = shard_for(username)
+    now = datetime.now()
+    window_columns = ', '.join(
+        f"COUNT(*) FILTER (WHERE occurred >= %(now)s - INTERVAL '{int(days)} days') AS last_{int(days)}"
+        for days in windows
+    )
+    totals = run_read(shard, f'''
+        SELECT habit, COUNT(*) AS total, AVG(clean_days)::float AS average_clean,
+               MAX(clean_days) AS longest_clean, MAX(occurred) AS last_relapse, {window_columns}
+        FROM relapses WHERE username = %(username)s
+        GROUP BY habit
+    ''', {'username': username, 'now': now}, fetch_all=True, username=username, replica_ok=replica_ok)
+    
+    # Two extra months are read so the first reported month's average is complete
+    trend = run_read(shard, '''
+        SELECT habit, to_char(month, 'YYYY-MM') AS month, relapses, rolling3
+        FROM (
+            SELECT habit, month, relapses,
+                   (SUM(relapses) OVER (
+                       PARTITION BY habit ORDER BY month
+                       RANGE BETWEEN INTERVAL '2 months' PRECEDING AND CURRENT ROW
+                   ) / 3.0)::float AS rolling3
+            FROM (
+                SELECT habit, date_trunc('month', occurred) AS month, COUNT(*) AS relapses
+                FROM relapses
+                WHERE username = %(username)s
+                  AND occurred >= date_trunc('month', %(now)s::timestamp) - %(back)s * INTERVAL '1 month'
+                GROUP BY habit, month
+            ) AS counts
+        ) AS rolling
+        WHERE month >= date_trunc('month', %(now)s::timestamp) - %(shown)s * INTERVAL '1 month'
+        ORDER BY habit, month
+    ''', {'username': username, 'now': now, 'back': months + 1, 'shown': months - 1},
+        fetch_all=True, username=username, replica_ok=replica_ok)
+    
+    aggregates = {}
+    for row in totals:
+        aggregates[row['habit']] = {
+            'total': row['total'],
+            'averageClean': row['average_clean'],
+            'longestClean': row['longest_clean'],
+            'lastRelapse': row['last_relapse'].isoformat(),
+            'windows': {days: row[f'last_{int(days)}'] for days in windows},
+            'monthly': [],
+        }
+    for row in trend:
+        aggregates[row['habit']]['monthly'].append({
+            'month': row['month'],
+            'relapses': row['relapses'],
+            'rolling3': round(row['rolling3'], 2),
+        })
+    return aggregates
+
+# Leaderboard
+
+def top_users(metric, limit, completed_since=None):
+    """Top limit users by a LEADERBOARD_COLUMNS metric across every shard
+    
+    Each shard answers from its column index; completed_since ('YYYY-MM-DD')
+    skips users whose last completion is older. Returns [{'username', 'value'}].
+    """
+    column = LEADERBOARD_COLUMNS[metric][0]
+    where = 'WHERE last_completed >= %s' if completed_since else ''
+    params = (completed_since, limit) if completed_since else (limit,)
+    rows = []
+    for shard in SHARDS:
+        rows.extend(run_read(shard, f'''
+            SELECT username, {column} AS value FROM users {where}
+            ORDER BY {column} DESC, username LIMIT %s
+        ''', params, fetch_all=True))
+    return [dict(row) for row in heapq.nsmallest(limit, rows, key=lambda row: (-row['value'], row['username']))]
+
+# Rebalancing
+
+def move_user(username, source, target):
+    """Move one user from source to target shard, returns True if moved
     
-    return [dict(user) for user in users]
\ No newline at end of file
+    Moves the user's row, archived row (see Cold storage) and relapse
+    events. The source rows are locked FOR UPDATE until they are deleted, so
+    writers, archiving and restores that still address the source wait, and
+    concurrent moves of the same user find nothing left to move.
+    """
+    src = get_db_connection(source['primary'])
+    try:
+        src_cur = src.cursor()
+        src_cur.execute('SELECT * FROM users WHERE username = %s FOR UPDATE', (username,))
+        row = src_cur.fetchone()
+        src_cur.execute('SELECT * FROM users_archive WHERE username = %s FOR UPDATE', (username,))
+        archived = src_cur.fetchone()
+        if row is None and archived is None:
+            src.rollback()
+            return False
+        
+        dst = get_db_connection(target['primary'])
+        try:
+            dst_cur = dst.cursor()
+            if row is not None:
+                dst_cur.execute('''
+                    INSERT INTO users (username, passcode, created, last_active, data) VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (username) DO UPDATE
+                    SET passcode = EXCLUDED.passcode, created = EXCLUDED.created,
+                        last_active = EXCLUDED.last_active, data = EXCLUDED.data
+                ''', (row['username'], row['passcode'], row['created'], row['last_active'], to_jsonb(row['data'])))
+            if archived is not None:
+                dst_cur.execute('''
+                    INSERT INTO users_archive (username, passcode, created, last_active, archived, data)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (username) DO UPDATE
+                    SET passcode = EXCLUDED.passcode, created = EXCLUDED.created, last_active = EXCLUDED.last_active,
+                        archived = EXCLUDED.archived, data = EXCLUDED.data
+                ''', (username, archived['passcode'], archived['created'], archived['last_active'],
+                      archived['archived'], psycopg2.Binary(archived['data'])))
+            
+            # The user's relapse events live on the same shard
+            src_cur.execute('SELECT habit, occurred, clean_days FROM relapses WHERE username = %s', (username,))
+            relapses = src_cur.fetchall()
+            if relapses:
+                execute_values(
+                    dst_cur,
+                    'INSERT INTO relapses (username, habit, occurred, clean_days) VALUES %s',
+                    [(username, r['habit'], r['occurred'], r['clean_days']) for r in relapses]
+                )
+            dst.commit()
+            dst_cur.close()
+        finally:
+            release_db_connection(dst)
+        
+        src_cur.execute('DELETE FROM relapses WHERE username = %s', (username,))
+        src_cur.execute('DELETE FROM users WHERE username = %s', (username,))
+        src_cur.execute('DELETE FROM users_archive WHERE username = %s', (username,))
+        src.commit()
+        src_cur.close()
+        print(f"📦 DATABASE: Moved {username} from {source['name']} to {target['name']}")
+        return True
+    finally:
+        release_db_connection(src)
+
+def locate_and_move(username, target):
+    """Find username on a shard other than target and move it there"""
+    for shard in SHARDS:
+        if shard is not target and move_user(username, shard, target):
+            return True
+    return False
+
+def misplaced_usernames(shard, batch_size=500):
+    """Yield usernames stored or archived on shard that the ring places elsewhere"""
+    last = ''
+    while True:
+        rows = run_read(
+            shard, '''
+                SELECT username FROM users WHERE username > %(last)s
+                UNION
+                SELECT username FROM users_archive WHERE username > %(last)s
+                ORDER BY username LIMIT %(limit)s
+            ''', {'last': last, 'limit': batch_size}, fetch_all=True, replica_ok=False
+        )
+        if not rows:
+            return
+        for row in rows:
+            if shard_for(row['username']) is not shard:
+                yield row['username']
+        last = rows[-1]['username']
+
+# Cold storage
+# archive_users.py moves users whose document hasn't been saved for a while
+# into users_archive as compressed JSON; get_user brings them back on their
+# next visit.
+
+def archive_user(shard, username, cutoff):
+    """Move one dormant user into shard's archive, returns (json bytes, packed bytes)
+    
+    Returns None if the user saved something since cutoff (or is gone).
+    """
+    conn = get_db_connection(shard['primary'])
+    try:
+        cur = conn.cursor()
+        cur.execute(
+            'DELETE FROM users WHERE username = %s AND last_active < %s RETURNING *',
+            (username, cutoff)
+        )
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        
+        packed = json_codec.pack(row['data'])
+        cur.execute('''
+            INSERT INTO users_archive (username, passcode, created, last_active, archived, data)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (username) DO UPDATE
+            SET passcode = EXCLUDED.passcode, created = EXCLUDED.created, last_active = EXCLUDED.last_active,
+                archived = EXCLUDED.archived, data = EXCLUDED.data
+        ''', (username, row['passcode'], row['created'], row['last_active'], datetime.now(), psycopg2.Binary(packed)))
+        conn.commit()
+        cur.close()
+        return len(json_codec.dumps(row['data']).encode('utf-8')), len(packed)
+    finally:
+        release_db_connection(conn)
+
+def restore_user(username, shard):
+    """Move username from shard's archive back into its users table
+    
+    Returns the restored row, or None if it wasn't archived there.
+    """
+    # Most lookups of unknown names (logins, registrations) aren't archived
+    # users, so check with a plain read before opening a write transaction
+    if run_read(shard, 'SELECT 1 FROM users_archive WHERE username = %s', (username,), replica_ok=False) is None:
+        return None
+    
+    conn = get_db_connection(shard['primary'])
+    try:
+        cur = conn.cursor()
+        cur.execute('DELETE FROM users_archive WHERE username = %s RETURNING *', (username,))
+        row = cur.fetchone()
+        if row is None:
+            conn.rollback()
+            return None
+        
+        data = json_codec.unpack(row['data'])
+        cur.execute('''
+            INSERT INTO users (username, passcode, created, last_active, data) VALUES (%s, %s, %s, NOW(), %s)
+            ON CONFLICT (username) DO NOTHING
+        ''', (username, row['passcode'], row['created'], to_jsonb(data)))
+        conn.commit()
+        cur.close()
+        mark_written(username)
+        print(f"📦 DATABASE: Restored {username} from cold storage")
+    finally:
+        release_db_connection(conn)
+    
+    # A concurrent restore may have won the race; either way the row is back
+    return get_user(username)
+
+def restore_archived_user(username, shard):
+    """Restore username from cold storage, looking on every shard mid-rebalance
+    
+    A user restored on another shard is then found and moved by get_user.
+    """
+    user = restore_user(username, shard)
+    if user is None and SHARD_REBALANCING:
+        for other in SHARDS:
+            if other is not shard:
+                user = restore_user(username, other)
+                if user is not None:
+                    break
+    return user
+
+def dormant_usernames(shard, cutoff, batch_size=500):
+    """Yield usernames on shard whose document hasn't been saved since cutoff"""
+    last = ''
+    while True:
+        rows = run_read(
+            shard, '''
+                SELECT username FROM users WHERE last_active < %s AND username > %s
+                ORDER BY username LIMIT %s
+            ''', (cutoff, last, batch_size), fetch_all=True, replica_ok=False
+        )
+        if not rows:
+            return
+        for row in rows:
+            yield row['username']
+        last = rows[-1]['username']
+
+def table_size(shard, table):
+    """On-disk size of table on shard, including its indexes and TOAST"""
+    row = run_read(shard, 'SELECT pg_total_relation_size(%s) AS size', (table,), replica_ok=False)
+    return row['size']
+
+def notify(channel, payload):
+    """Send a NOTIFY on channel to every listening worker"""
+    conn = get_db_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute('SELECT pg_notify(%s, %s)', (channel, payload))
+        conn.commit()
+        cur.close()
+    finally:
+        release_db_connection(conn)
+
+def listen(channel):
+    """Open a dedicated autocommit connection LISTENing on channel
+    
+    Kept outside the pool because it stays open for the life of the worker.
+    """
+    conn = psycopg2.connect(DATABASE_URL)
+    conn.autocommit = True
+    cur = conn.cursor()
+    cur.execute(f'LISTEN {channel}')
+    cur.close()
+    return conn
@@ -0,0 +1,213 @@
+"""
+Typed in-memory user documents
+
+A loaded document is a Document: a mapping of top-level sections in which
+categories, tasks, milestones and history entries are __slots__ records
+rather than dicts. Records keep dict-style access (record['text'],
+record.get('id')), so the operation handlers work on them unchanged, and
+keys outside a record's FIELDS go to a small overflow dict.
+
+The large, rarely used sections in LAZY_SECTIONS can be handed over as the
+JSON text they were stored as (database.get_user selects them that way).
+They are decoded the first time they are read, and encoding a document
+splices untouched ones back in as they are (see json_codec.fragment), so a
+request pays only for the sections it uses.
+"""
+from collections.abc import MutableMapping
+
+import json_codec
+
+LAZY_SECTIONS = ('history', 'quoteQueue', 'stats', 'badHabits')
+
+class VersionConflict(Exception):
+    """The stored document is no longer the version an update was based on"""
+
+class Record(MutableMapping):
+    """A dict-like record with its known keys in slots"""
+    __slots__ = ('_extra',)
+    FIELDS = ()
+    NESTED = {}  # key -> record type of the items of that list
+
+    def __init__(self, values=()):
+        self._extra = None
+        for key, value in dict(values).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is None or key not in self._extra:
+            raise KeyError(key)
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        if key in self.NESTED and isinstance(value, list):
+            value = wrap_list(self.NESTED[key], value)
+        if key in self.FIELDS:
+            setattr(self, key, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in self.FIELDS:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        for key in self.FIELDS:
+            if hasattr(self, key):
+                yield key
+        if self._extra:
+            yield from self._extra
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_json()!r})"
+
+    def to_json(self):
+        return dict(self.items())
+
+class Task(Record):
+    FIELDS = ('id', 'text', 'completed', 'recurring')
+    __slots__ = FIELDS
+
+class Category(Record):
+    FIELDS = ('id', 'name', 'icon', 'tasks')
+    NESTED = {'tasks': Task}
+    __slots__ = FIELDS
+
+class Milestone(Record):
+    FIELDS = ('id', 'text', 'targetDate', 'completed', 'type', 'category', 'priority')
+    __slots__ = FIELDS
+
+class HistoryEntry(Record):
+    FIELDS = ('date', 'tasksCompleted', 'streak')
+    __slots__ = FIELDS
+
+# Record type of the items of each list section
+SECTION_RECORDS = {'categories': Category, 'milestones': Milestone, 'history': HistoryEntry}
+# Record type of each item kind (see item_ids.PREFIXES); habits stay dicts
+KIND_RECORDS = {'category': Category, 'task': Task, 'milestone': Milestone}
+
+def wrap_list(record_type, items):
+    return [
+        record_type(item) if isinstance(item, dict) else item
+        for item in items
+    ]
+
+def record(kind, values):
+    """values as the record type of an item kind (unchanged for kinds without one)"""
+    record_type = KIND_RECORDS.get(kind)
+    return record_type(values) if record_type is not None else values
+
+class Document(MutableMapping):
+    """A user document whose LAZY_SECTIONS may still be undecoded JSON text"""
+    __slots__ = ('_sections', '_raw')
+
+    def __init__(self, sections=(), raw=None):
+        self._sections = {}
+        self._raw = {key: text for key, text in (raw or {}).items() if text is not None}
+        for key, value in dict(sections).items():
+            self[key] = value
+
+    def __getitem__(self, key):
+        if key not in self._sections and key in self._raw:
+            # Decode before dropping the text, other threads may be reading too
+            self._sections[key] = self._wrap(key, json_codec.loads(self._raw[key]))
+            self._raw.pop(key, None)
+        return self._sections[key]
+
+    def __setitem__(self, key, value):
+        self._sections[key] = self._wrap(key, value)
+        self._raw.pop(key, None)
+
+    def __delitem__(self, key):
+        if key not in self._sections and key not in self._raw:
+            raise KeyError(key)
+        self._sections.pop(key, None)
+        self._raw.pop(key, None)
+
+    def __contains__(self, key):
+        return key in self._sections or key in self._raw
+
+    def __iter__(self):
+        yield from self._sections
+        yield from (key for key in self._raw if key not in self._sections)
+
+    def __len__(self):
+        return len(self._sections) + sum(1 for key in self._raw if key not in self._sections)
+
+    def __repr__(self):
+        return f"Document(sections={sorted(self._sections)}, undecoded={sorted(self._raw)})"
+
+    @staticmethod
+    def _wrap(key, value):
+        record_type = SECTION_RECORDS.get(key)
+        if record_type is not None and isinstance(value, list):
+            return wrap_list(record_type, value)
+        return value
+
+    def is_empty(self, key):
+        """Whether section key is missing or empty, without decoding it"""
+        if key in self._raw:
+            return self._raw[key].strip() in ('', 'null', '[]', '{}')
+        return not self._sections.get(key)
+
+    def append(self, key, item):
+        """Append item to list section key, without decoding it if it is still text"""
+        if key in self._raw:
+            text = self._raw[key].rstrip()
+            if text.endswith(']'):
+                body = text[:-1].rstrip()
+                separator = '' if body.endswith('[') else ','
+                self._raw[key] = f"{body}{separator}{json_codec.dumps(item)}]"
+                return
+        self.setdefault(key, []).append(self._wrap(key, [item])[0])
+
+    def take(self, other, key):
+        """Copy section key from another document, as text if it is still undecoded"""
+        if key in other._raw and key not in other._sections:
+            self._sections.pop(key, None)
+            self._raw[key] = other._raw[key]
+        else:
+            self[key] = other[key]
+
+    def only(self, keys):
+        """Shallow copy with just the sections in keys"""
+        subset = Document()
+        subset._sections = {key: value for key, value in self._sections.items() if key in keys}
+        subset._raw = {key: text for key, text in self._raw.items() if key in keys}
+        return subset
+
+    def without(self, keys):
+        """Shallow copy without the sections in keys"""
+        return self.only([key for key in self if key not in keys])
+
+    def to_json(self):
+        """Plain mapping for json_codec, undecoded sections as fragments"""
+        encoded = dict(self._sections)
+        for key, text in self._raw.items():
+            if key not in encoded:
+                encoded[key] = json_codec.fragment(text)
+        return encoded
+
+def load(value):
+    """Document from a Document, a decoded dict or JSON text"""
+    if isinstance(value, Document):
+        return value
+    if not isinstance(value, dict):
+        value = json_codec.loads(value)
+    return Document(value)
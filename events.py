@@ -0,0 +1,157 @@
+"""
+Change notifications for GET /api/events (server-sent events)
+
+publish() is called after a user's document is saved, and every open event
+stream for that user receives a small {resource, path, version} message.
+Messages travel between gunicorn workers through Postgres LISTEN/NOTIFY in
+database mode, and through an append-only log file in JSON file mode. Each
+worker runs one background listener thread that fans messages out to the
+streams it holds.
+
+An open stream occupies a gthread worker thread, so streams are capped at
+EVENTS_MAX_STREAMS per process and gunicorn.conf.py gives every worker that
+many threads on top of its request threads. Streams are closed after
+EVENTS_STREAM_SECONDS; EventSource reconnects on its own.
+"""
+import os
+import queue
+import select
+import threading
+import time
+
+import json_codec
+
+CHANNEL = 'momentum_events'
+EVENTS_FILE = os.environ.get('EVENTS_FILE', 'events.log')
+EVENTS_FILE_MAX_BYTES = 1024 * 1024
+FILE_POLL_SECONDS = 0.5
+HEARTBEAT_SECONDS = 15
+EVENTS_STREAM_SECONDS = int(os.environ.get('EVENTS_STREAM_SECONDS', 300))
+EVENTS_MAX_STREAMS = int(os.environ.get('EVENTS_MAX_STREAMS', 16))
+
+use_database = False
+
+_subscribers = {}  # username -> set of queues
+_subscribers_lock = threading.Lock()
+_stream_slots = threading.BoundedSemaphore(EVENTS_MAX_STREAMS)
+_listener_started = False
+_file_lock = threading.Lock()
+
+def init_events(database_mode):
+    """Select the cross-worker transport: Postgres or the events log file"""
+    global use_database
+    use_database = database_mode
+
+def publish(username, resource, path, version):
+    """Notify every worker that username's document changed"""
+    event = {'username': username, 'resource': resource, 'path': path, 'version': version}
+    try:
+        if use_database:
+            import database
+            database.notify(CHANNEL, json_codec.dumps(event))
+        else:
+            _append_event(event)
+    except Exception as e:
+        print(f"⚠️ Could not publish change event for {username}: {str(e)}")
+
+def _append_event(event):
+    line = (json_codec.dumps(event) + '\n').encode('utf-8')
+    with _file_lock:
+        # Listeners notice the file shrinking and start over from the top
+        if os.path.exists(EVENTS_FILE) and os.path.getsize(EVENTS_FILE) > EVENTS_FILE_MAX_BYTES:
+            open(EVENTS_FILE, 'wb').close()
+        with open(EVENTS_FILE, 'ab') as f:
+            f.write(line)
+
+def _dispatch(event):
+    with _subscribers_lock:
+        targets = list(_subscribers.get(event.get('username'), ()))
+    for q in targets:
+        try:
+            q.put_nowait(event)
+        except queue.Full:
+            pass
+
+def _listen_postgres():
+    import database
+    while True:
+        conn = None
+        try:
+            conn = database.listen(CHANNEL)
+            while True:
+                if select.select([conn], [], [], HEARTBEAT_SECONDS) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    _dispatch(json_codec.loads(conn.notifies.pop(0).payload))
+        except Exception as e:
+            print(f"⚠️ Event listener error, reconnecting: {str(e)}")
+            time.sleep(5)
+        finally:
+            if conn is not None:
+                conn.close()
+
+def _tail_events_file():
+    position = os.path.getsize(EVENTS_FILE) if os.path.exists(EVENTS_FILE) else 0
+    while True:
+        try:
+            size = os.path.getsize(EVENTS_FILE) if os.path.exists(EVENTS_FILE) else 0
+            if size < position:
+                position = 0
+            if size > position:
+                with open(EVENTS_FILE, 'rb') as f:
+                    f.seek(position)
+                    chunk = f.read(size - position)
+                # Only consume complete lines, a write may be in progress
+                end = chunk.rfind(b'\n') + 1
+                for line in chunk[:end].splitlines():
+                    if line.strip():
+                        _dispatch(json_codec.loads(line))
+                position += end
+        except Exception as e:
+            print(f"⚠️ Event log read error: {str(e)}")
+        time.sleep(FILE_POLL_SECONDS)
+
+def _ensure_listener():
+    global _listener_started
+    with _subscribers_lock:
+        if _listener_started:
+            return
+        _listener_started = True
+    target = _listen_postgres if use_database else _tail_events_file
+    threading.Thread(target=target, name='events-listener', daemon=True).start()
+
+def subscribe(username):
+    """Register a stream for username, or return None if this worker is full"""
+    if not _stream_slots.acquire(blocking=False):
+        return None
+    _ensure_listener()
+    q = queue.Queue(maxsize=100)
+    with _subscribers_lock:
+        _subscribers.setdefault(username, set()).add(q)
+    return q
+
+def unsubscribe(username, q):
+    with _subscribers_lock:
+        streams = _subscribers.get(username)
+        if streams is not None and q in streams:
+            streams.discard(q)
+            if not streams:
+                del _subscribers[username]
+            _stream_slots.release()
+
+def stream(q):
+    """Yield the SSE text for a subscription until EVENTS_STREAM_SECONDS pass"""
+    deadline = time.monotonic() + EVENTS_STREAM_SECONDS
+    yield 'retry: 5000\n\n'
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        try:
+            event = q.get(timeout=min(HEARTBEAT_SECONDS, remaining))
+        except queue.Empty:
+            yield ': keepalive\n\n'
+            continue
+        message = {key: event.get(key) for key in ('resource', 'path', 'version')}
+        yield f"event: change\ndata: {json_codec.dumps(message)}\n\n"
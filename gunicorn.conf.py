@@ -0,0 +1,75 @@
+"""
+Gunicorn configuration
+
+Runs the app on threaded (gthread) workers so a slow Gemini call or Postgres
+round trip blocks one thread instead of a whole worker process. Every knob
+can be overridden from the environment.
+
+An open /api/events stream holds a thread for up to EVENTS_STREAM_SECONDS,
+so each worker runs GUNICORN_THREADS request threads plus one thread per
+event stream it accepts (EVENTS_MAX_STREAMS, which events.py enforces).
+Streams can never take the threads requests need; once a worker's streams
+are all open, /api/events answers 503 and the browser retries a minute
+later. Stream threads sleep between 15 s heartbeats, so they cost a thread
+stack each rather than CPU: raise EVENTS_MAX_STREAMS with the number of
+dashboards open at once.
+
+Sizing for our usual 1-2 CPU instances:
+  1 CPU  -> 3 workers x (4 + 16) threads = 12 requests + 48 event streams
+  2 CPUs -> 5 workers x (4 + 16) threads = 20 requests + 80 event streams
+Each worker keeps its own Postgres pool of up to DB_POOL_MAX connections
+(defaults to GUNICORN_THREADS), so the database sees workers x DB_POOL_MAX
+connections at most. Keep that under the plan's connection limit. A worker
+has more threads than connections: an open event stream holds none, but
+any thread can serve an ordinary request, and the write-behind flusher
+uses the pool too. When every connection is in use, the next thread waits
+for one (up to DB_POOL_TIMEOUT seconds, see database.py) rather than
+failing.
+"""
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5001)}"
+
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+worker_class = 'gthread'
+request_threads = int(os.environ.get('GUNICORN_THREADS', 4))
+# Exported so the workers' events.py caps streams at the threads added for them
+event_streams = int(os.environ.setdefault('EVENTS_MAX_STREAMS', '16'))
+threads = request_threads + event_streams
+
+# Gemini batch generation takes ~3-5 seconds, leave plenty of headroom
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+graceful_timeout = 30
+keepalive = 5
+
+# Don't preload: the database pool and the Gemini gRPC client must be
+# created after the fork, inside each worker
+preload_app = False
+
+accesslog = '-'
+errorlog = '-'
+
+def on_starting(server):
+    """Create or upgrade the database schema once, before any worker boots
+    
+    Workers see DB_SCHEMA_READY and skip init_db. If it fails here, each
+    worker tries again on its own (and falls back as before).
+    """
+    if not os.environ.get('DATABASE_URL', '').strip():
+        return
+    try:
+        import database
+        database.init_db()
+        # Workers must open their own connections after the fork
+        database.close_pools()
+        os.environ['DB_SCHEMA_READY'] = '1'
+    except Exception as e:
+        print(f"❌ Schema setup failed, leaving it to the workers: {type(e).__name__}: {str(e)}")
+
+def worker_exit(server, worker):
+    """Commit any write-behind updates before the worker goes away"""
+    import sys
+    database = sys.modules.get('database')
+    if database is not None:
+        database.flush_write_buffer()
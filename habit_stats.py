@@ -0,0 +1,217 @@
+"""
+Bad habit statistics for GET /api/bad-habits/stats
+
+Relapses are recorded as events outside the user document: rows in the
+relapses table in database mode (aggregated with window functions, see
+database.relapse_aggregates), and incremental per-habit aggregates in
+HABIT_STATS_FILE in JSON file mode. Both produce the same aggregate shape,
+which summarize() combines with the habit itself. Days clean is always
+derived from the habit's cleanSince when the stats are read.
+"""
+import os
+import threading
+from datetime import datetime, timedelta
+
+import json_codec
+
+HABIT_STATS_FILE = os.environ.get('HABIT_STATS_FILE', 'habit_stats.json')
+RATE_WINDOWS = (30, 90, 365)
+TREND_MONTHS = 12
+# Daily buckets kept in file mode, enough for every rate window and the monthly trend
+DAILY_RETENTION_DAYS = 400
+
+use_database = False
+
+_file_lock = threading.Lock()
+
+def init_habit_stats(database_mode):
+    """Select where relapse events are stored: Postgres or the stats file"""
+    global use_database
+    use_database = database_mode
+
+def parse_time(value):
+    """Naive local datetime from an ISO string (the client sends UTC 'Z' times)"""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+def days_since(value, now):
+    if not value:
+        return 0
+    return max(0, (now - parse_time(value)).days)
+
+def record_relapse(username, habit, occurred, clean_days):
+    """Store one relapse event; clean_days is the length of the streak it ended"""
+    if use_database:
+        import database
+        database.record_relapse(username, habit, occurred, clean_days)
+    else:
+        _record_file_relapse(username, habit, occurred, clean_days)
+
+def relapse_aggregates(username, now, replica_ok=False):
+    """{habit name: aggregate} for every habit of username with relapses
+
+    An aggregate is {'total', 'averageClean', 'longestClean', 'lastRelapse',
+    'windows': {days: relapses in the last days}, 'monthly': [{'month',
+    'relapses', 'rolling3'}]}, monthly covering the last TREND_MONTHS months
+    that had relapses.
+    """
+    if use_database:
+        import database
+        return database.relapse_aggregates(username, RATE_WINDOWS, TREND_MONTHS, replica_ok=replica_ok)
+    return _file_aggregates(username, now)
+
+def legacy_relapses(habit):
+    """Sorted (occurred, clean_days) of the entries in a habit's legacy relapses list"""
+    events = set()
+    for entry in habit.get('relapses') or []:
+        try:
+            events.add((parse_time(entry['date']), int(entry.get('daysSober') or 0)))
+        except (KeyError, TypeError, ValueError):
+            continue
+    return sorted(events)
+
+def import_legacy_relapses(username, habits):
+    """Record the relapses embedded in documents before schema v7 as events
+
+    Events already imported are skipped, so this can run more than once.
+    """
+    for habit in habits:
+        events = legacy_relapses(habit)
+        if not events:
+            continue
+        if use_database:
+            import database
+            database.import_relapses(username, habit.get('name'), events)
+        else:
+            _import_file_relapses(username, habit.get('name'), events)
+
+# JSON file backend
+
+def _load_file():
+    if not os.path.exists(HABIT_STATS_FILE):
+        return {}
+    try:
+        with open(HABIT_STATS_FILE, 'r', encoding='utf-8') as f:
+            return json_codec.loads(f.read())
+    except ValueError:
+        return {}
+
+def _save_file(stats):
+    tmp_file = f"{HABIT_STATS_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        f.write(json_codec.dumps(stats))
+    os.replace(tmp_file, HABIT_STATS_FILE)
+
+def _file_aggregate(stats, username, habit):
+    return stats.setdefault(username, {}).setdefault(habit, {
+        'total': 0, 'cleanDaysTotal': 0, 'longestClean': 0, 'lastRelapse': None, 'daily': {}
+    })
+
+def _fold_relapse(aggregate, occurred, clean_days):
+    aggregate['total'] += 1
+    aggregate['cleanDaysTotal'] += clean_days
+    aggregate['longestClean'] = max(aggregate['longestClean'], clean_days)
+    aggregate['lastRelapse'] = max(aggregate['lastRelapse'] or '', occurred.isoformat())
+    day = occurred.date().isoformat()
+    aggregate['daily'][day] = aggregate['daily'].get(day, 0) + 1
+
+def _trim_daily(aggregate, today):
+    cutoff = (today - timedelta(days=DAILY_RETENTION_DAYS)).isoformat()
+    aggregate['daily'] = {d: n for d, n in aggregate['daily'].items() if d >= cutoff}
+
+def _record_file_relapse(username, habit, occurred, clean_days):
+    with _file_lock:
+        stats = _load_file()
+        aggregate = _file_aggregate(stats, username, habit)
+        _fold_relapse(aggregate, occurred, clean_days)
+        _trim_daily(aggregate, occurred.date())
+        _save_file(stats)
+
+def _import_file_relapses(username, habit, events):
+    with _file_lock:
+        stats = _load_file()
+        aggregate = _file_aggregate(stats, username, habit)
+        # Aggregates can't tell events apart, so the import is remembered instead
+        if aggregate.get('legacyImported'):
+            return
+        for occurred, clean_days in events:
+            _fold_relapse(aggregate, occurred, clean_days)
+        _trim_daily(aggregate, datetime.now().date())
+        aggregate['legacyImported'] = True
+        _save_file(stats)
+
+def _file_aggregates(username, now):
+    with _file_lock:
+        user_stats = _load_file().get(username, {})
+
+    first_month = month_start(now, TREND_MONTHS - 1)
+    result = {}
+    for habit, aggregate in user_stats.items():
+        daily = aggregate['daily']
+        windows = {}
+        for days in RATE_WINDOWS:
+            since = (now - timedelta(days=days)).date().isoformat()
+            windows[days] = sum(n for d, n in daily.items() if d >= since)
+
+        months = {}
+        for d, n in daily.items():
+            if d >= first_month:
+                months[d[:7]] = months.get(d[:7], 0) + n
+        monthly = [
+            {
+                'month': month,
+                'relapses': months[month],
+                'rolling3': round(sum(months.get(m, 0) for m in previous_months(month, 3)) / 3, 2),
+            }
+            for month in sorted(months)
+        ]
+
+        result[habit] = {
+            'total': aggregate['total'],
+            'averageClean': aggregate['cleanDaysTotal'] / aggregate['total'],
+            'longestClean': aggregate['longestClean'],
+            'lastRelapse': aggregate['lastRelapse'],
+            'windows': windows,
+            'monthly': monthly,
+        }
+    return result
+
+def month_start(now, months_back):
+    """ISO date of the first day of the month months_back before now's"""
+    index = now.year * 12 + now.month - 1 - months_back
+    return f"{index // 12:04d}-{index % 12 + 1:02d}-01"
+
+def previous_months(month, count):
+    """'YYYY-MM' of month and the count - 1 months before it"""
+    year, number = map(int, month.split('-'))
+    index = year * 12 + number - 1
+    return [f"{i // 12:04d}-{i % 12 + 1:02d}" for i in range(index - count + 1, index + 1)]
+
+def summarize(habit, aggregate, now):
+    """Stats for one habit from its document entry and its relapse aggregate"""
+    current = days_since(habit.get('cleanSince'), now)
+    windows = aggregate['windows'] if aggregate else {days: 0 for days in RATE_WINDOWS}
+    # Relapses per 30 days, averaged over each window
+    rates = {f"{days}d": round(windows[days] * 30 / days, 2) for days in RATE_WINDOWS}
+
+    if rates['30d'] < rates['90d']:
+        trend = 'improving'
+    elif rates['30d'] > rates['90d']:
+        trend = 'worsening'
+    else:
+        trend = 'steady'
+
+    return {
+        'name': habit.get('name'),
+        'cleanSince': habit.get('cleanSince'),
+        'currentDaysClean': current,
+        'longestStreak': max(habit.get('longestStreak', 0), aggregate['longestClean'] if aggregate else 0, current),
+        'averageCleanStreak': round(aggregate['averageClean'], 1) if aggregate else None,
+        'totalRelapses': habit.get('relapseCount', 0),
+        'lastRelapse': habit.get('lastRelapseDate'),
+        'relapseRates': rates,
+        'trend': trend,
+        'monthly': aggregate['monthly'] if aggregate else [],
+    }
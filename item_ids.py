@@ -0,0 +1,52 @@
+"""
+Stable item IDs
+
+Every category, task, milestone and bad habit carries a compact 'id'
+assigned by the server: a kind prefix plus the base36 value of the
+document's idSeq counter (e.g. 't1f'). An ID never changes and is never
+reused within a document, so it keeps addressing the same item while others
+are added, removed or reordered. build_index() maps every ID to its
+location for O(1) lookups.
+"""
+import string
+
+PREFIXES = {'category': 'c', 'task': 't', 'milestone': 'm', 'habit': 'h'}
+
+_DIGITS = string.digits + string.ascii_lowercase
+
+def to_base36(number):
+    digits = ''
+    while True:
+        number, remainder = divmod(number, 36)
+        digits = _DIGITS[remainder] + digits
+        if number == 0:
+            return digits
+
+def new_id(data, kind):
+    """Next unused ID of kind in data"""
+    data['idSeq'] = data.get('idSeq', 0) + 1
+    return PREFIXES[kind] + to_base36(data['idSeq'])
+
+def iter_items(data):
+    """Yield (kind, containing list, item) for every addressable item"""
+    for category in data.get('categories', []):
+        yield 'category', data['categories'], category
+        for task in category.get('tasks', []):
+            yield 'task', category['tasks'], task
+    for milestone in data.get('milestones', []):
+        yield 'milestone', data['milestones'], milestone
+    for habit in data.get('badHabits', []):
+        yield 'habit', data['badHabits'], habit
+
+def assign_ids(data):
+    """Give every item without an ID one, returns True if any was assigned"""
+    assigned = False
+    for kind, _, item in iter_items(data):
+        if not item.get('id'):
+            item['id'] = new_id(data, kind)
+            assigned = True
+    return assigned
+
+def build_index(data):
+    """{id: (kind, containing list, item)} for every item with an ID"""
+    return {item['id']: (kind, items, item) for kind, items, item in iter_items(data) if item.get('id')}
@@ -0,0 +1,61 @@
+"""
+JSON codec shared by the storage layer and Flask's JSON provider
+
+Uses orjson when it is installed and falls back to the standard library
+json module otherwise. Both paths produce compact UTF-8 JSON text.
+pack()/unpack() add zlib compression for documents kept in cold storage.
+Objects with a to_json() method (documents and their records, see
+document.py) are encoded as what it returns.
+"""
+import json
+import zlib
+from datetime import date, datetime
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKEND = 'orjson' if orjson else 'json'
+
+def _default(obj):
+    """Encode types the backends don't handle natively"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    to_json = getattr(obj, 'to_json', None)
+    if to_json is not None:
+        return to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+def loads(s):
+    """Decode JSON text (str or bytes)"""
+    if orjson:
+        return orjson.loads(s)
+    return json.loads(s)
+
+def dumps(obj, indent=False):
+    """Encode obj as a JSON string, optionally indented for humans"""
+    if orjson:
+        option = orjson.OPT_INDENT_2 if indent else 0
+        return orjson.dumps(obj, default=_default, option=option).decode('utf-8')
+    if indent:
+        return json.dumps(obj, default=_default, ensure_ascii=False, indent=2)
+    return json.dumps(obj, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+def fragment(text):
+    """Already-encoded JSON text to embed in dumps() output
+    
+    orjson splices it in without decoding it, the json module can't, so
+    there it is decoded and encoded again.
+    """
+    if orjson:
+        return orjson.Fragment(text)
+    return loads(text)
+
+def pack(obj):
+    """Encode obj as zlib-compressed JSON bytes"""
+    return zlib.compress(dumps(obj).encode('utf-8'), 9)
+
+def unpack(blob):
+    """Decode bytes produced by pack()"""
+    return loads(zlib.decompress(bytes(blob)))
@@ -0,0 +1,105 @@
+"""
+Cross-user streak leaderboards for GET /api/leaderboard
+
+The ranked fields are promoted out of the user document: generated columns
+with descending B-tree indexes in database mode (see database.top_users),
+and per-metric lists sorted by (-value, username), rebuilt when the data
+file changes, in JSON file mode. Either way a board is the first entries of
+an ordered structure, and results are cached for LEADERBOARD_TTL_SECONDS so
+repeated requests don't touch storage at all.
+
+A current streak only counts while the user last completed a day yesterday
+or today; older streaks are about to be reset and are left off the board.
+"""
+import os
+import threading
+import time
+from datetime import timedelta
+
+import json_codec
+
+METRICS = ('currentStreak', 'longestStreak', 'totalDaysCompleted')
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 50
+LEADERBOARD_TTL_SECONDS = float(os.environ.get('LEADERBOARD_TTL_SECONDS', 30))
+
+use_database = False
+data_file = None
+
+_cache = {}  # (metric, limit, day) -> (expires, leaders)
+_cache_lock = threading.Lock()
+_file_index = None  # (mtime, {metric: [(-value, username, lastCompletedDay)]})
+_file_index_lock = threading.Lock()
+
+def init_leaderboard(database_mode, users_file):
+    """Select where boards are read from: Postgres or the users file"""
+    global use_database, data_file
+    use_database = database_mode
+    data_file = users_file
+
+def top(metric, limit, today):
+    """[{'rank', 'username', 'value'}] for the top limit users by metric"""
+    key = (metric, limit, today)
+    now = time.monotonic()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached[0] > now:
+            return cached[1]
+
+    # Only yesterday's or today's completions keep a current streak alive
+    completed_since = (today - timedelta(days=1)).isoformat() if metric == 'currentStreak' else None
+    if use_database:
+        import database
+        rows = database.top_users(metric, limit, completed_since)
+    else:
+        rows = _file_top(metric, limit, completed_since)
+    leaders = [
+        {'rank': rank, 'username': row['username'], 'value': row['value']}
+        for rank, row in enumerate(rows, 1)
+    ]
+
+    with _cache_lock:
+        # Drop expired boards (there are only a few metric/limit pairs)
+        for stale in [k for k, (expires, _) in _cache.items() if expires <= now]:
+            del _cache[stale]
+        _cache[key] = (now + LEADERBOARD_TTL_SECONDS, leaders)
+    return leaders
+
+# JSON file backend
+
+def _build_file_index():
+    try:
+        with open(data_file, 'r', encoding='utf-8') as f:
+            users = json_codec.loads(f.read())
+    except (OSError, ValueError):
+        users = {}
+    index = {}
+    for metric in METRICS:
+        entries = []
+        for username, user in users.items():
+            data = user.get('data') or {}
+            last_day = (data.get('lastCompletedDate') or '')[:10]
+            entries.append((-int(data.get(metric) or 0), username, last_day))
+        entries.sort()
+        index[metric] = entries
+    return index
+
+def _file_top(metric, limit, completed_since):
+    global _file_index
+    try:
+        mtime = os.stat(data_file).st_mtime_ns
+    except OSError:
+        return []
+    with _file_index_lock:
+        if _file_index is None or _file_index[0] != mtime:
+            _file_index = (mtime, _build_file_index())
+        entries = _file_index[1][metric]
+
+    rows = []
+    for value, username, last_day in entries:
+        if len(rows) == limit:
+            break
+        if completed_since and last_day < completed_since:
+            continue
+        rows.append({'username': username, 'value': -value})
+    return rows
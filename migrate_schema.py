@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Upgrade every stored user document to the current schema version
+
+Runs the upgrade steps in schema.py over all users, in batches of
+--batch-size per transaction on every Postgres shard, or over the whole
+users_data.json in JSON file mode. Documents already at
+CURRENT_SCHEMA_VERSION are left alone, so it is safe to re-run and to run
+while the app is serving (in JSON file mode it takes the same lock file as
+the app's saves). Archived users are upgraded when they are restored.
+
+Usage: python migrate_schema.py [--batch-size N] [--dry-run]
+"""
+import sys
+
+import schema
+from app import USE_DATABASE, load_users, save_users, users_file_lock
+
+def migrate_database(batch_size, dry_run):
+    from database import SHARDS, upgrade_shard_documents
+
+    total = 0
+    for shard in SHARDS:
+        count = upgrade_shard_documents(shard, batch_size=batch_size, dry_run=dry_run)
+        print(f"📦 {shard['name']}: {count} documents")
+        total += count
+    return total
+
+def migrate_file(dry_run):
+    with users_file_lock:
+        users = load_users()
+        outdated = [(username, user) for username, user in users.items() if not schema.is_current(user['data'])]
+        for username, user in outdated:
+            schema.upgrade(user['data'], None if dry_run else username)
+        if outdated and not dry_run:
+            save_users(users)
+    return len(outdated)
+
+def main():
+    args = sys.argv[1:]
+    dry_run = '--dry-run' in args
+    batch_size = int(args[args.index('--batch-size') + 1]) if '--batch-size' in args else 500
+    print(f"🔧 Upgrading documents to schema version {schema.CURRENT_SCHEMA_VERSION}"
+          f"{' (dry run)' if dry_run else ''}")
+
+    if USE_DATABASE:
+        total = migrate_database(batch_size, dry_run)
+    else:
+        total = migrate_file(dry_run)
+
+    action = 'to upgrade' if dry_run else 'upgraded'
+    print(f"\n✅ Schema migration complete: {total} documents {action}")
+
+if __name__ == '__main__':
+    main()
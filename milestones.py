@@ -0,0 +1,73 @@
+"""
+Date-ordered milestones and deadlines
+
+data['milestones'] (milestones and deadline tasks alike) is kept sorted by
+(targetDate, id), so a date window is found with two binary searches and
+GET /api/milestones never looks at entries outside it. targetDate is an
+ISO 'YYYY-MM-DD' string, which sorts chronologically as text.
+"""
+import bisect
+from datetime import date, timedelta
+
+TYPES = ('milestone', 'deadline')
+STATUSES = ('open', 'completed', 'overdue')
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 200
+
+def sort_key(milestone):
+    return (milestone.get('targetDate') or '', milestone.get('id') or '')
+
+def sort_milestones(data):
+    """Restore the order after a full document save (nearly sorted already)"""
+    data['milestones'].sort(key=sort_key)
+
+def parse_cursor(cursor):
+    """(targetDate, id) of the last item on the previous page"""
+    target_date, separator, item_id = cursor.partition('~')
+    if not separator:
+        raise ValueError('Invalid cursor')
+    return (target_date, item_id)
+
+def query(milestones, today, date_from=None, date_to=None, kind=None, status=None,
+          limit=DEFAULT_LIMIT, cursor=None):
+    """One page of the milestones in [date_from, date_to] matching kind and status
+
+    Dates are date objects (either bound may be None). Returns
+    (page, next cursor or None).
+    """
+    start = 0
+    if date_from is not None:
+        start = bisect.bisect_left(milestones, (date_from.isoformat(), ''), key=sort_key)
+    if cursor is not None:
+        start = max(start, bisect.bisect_right(milestones, parse_cursor(cursor), key=sort_key))
+    end = len(milestones)
+    if date_to is not None:
+        end = bisect.bisect_left(milestones, ((date_to + timedelta(days=1)).isoformat(), ''), key=sort_key)
+
+    today = today.isoformat()
+    page = []
+    for position in range(start, end):
+        milestone = milestones[position]
+        if kind is not None and milestone.get('type', 'milestone') != kind:
+            continue
+        if status == 'open' and milestone.get('completed'):
+            continue
+        if status == 'completed' and not milestone.get('completed'):
+            continue
+        if status == 'overdue':
+            # Overdue entries all sort before today's
+            if (milestone.get('targetDate') or '') >= today:
+                break
+            if milestone.get('completed'):
+                continue
+        if len(page) == limit:
+            last = page[-1]
+            return page, f"{last.get('targetDate') or ''}~{last.get('id') or ''}"
+        page.append(milestone)
+    return page, None
+
+def parse_date(value):
+    """date from an ISO 'YYYY-MM-DD' query parameter, None if absent"""
+    if not value:
+        return None
+    return date.fromisoformat(value)
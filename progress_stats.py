@@ -0,0 +1,103 @@
+"""
+Progress analytics for GET /api/stats
+
+complete_day folds each completion into data['stats'], so reading the
+stats never scans history:
+  completedDays   date ordinals of completions in the last MAX_WINDOW days
+  categories      {category name: {'days': n, 'tasks': n}} completed so far
+  streaks         {length: count} of streaks that have ended
+  run             streak length at the last completion
+"""
+import bisect
+from datetime import datetime
+
+WINDOWS = (7, 30, 90, 365)
+MAX_WINDOW = max(WINDOWS)
+
+# Streak distribution buckets: (label, shortest, longest)
+STREAK_BUCKETS = (
+    ('1', 1, 1),
+    ('2-3', 2, 3),
+    ('4-7', 4, 7),
+    ('8-14', 8, 14),
+    ('15-30', 15, 30),
+    ('31+', 31, None),
+)
+
+def empty_stats():
+    return {'completedDays': [], 'categories': {}, 'streaks': {}, 'run': 0}
+
+def record_completion(data, day, streak, tasks_by_category):
+    """Fold one completed day into data['stats']
+
+    streak is the streak after this completion; tasks_by_category maps
+    category name to the number of tasks completed in it.
+    """
+    stats = data.setdefault('stats', empty_stats())
+
+    # A streak restarting at 1 means the previous run has ended
+    if streak == 1 and stats['run'] > 0:
+        key = str(stats['run'])
+        stats['streaks'][key] = stats['streaks'].get(key, 0) + 1
+    stats['run'] = streak
+
+    days = stats['completedDays']
+    days.append(day.toordinal())
+    cutoff = day.toordinal() - MAX_WINDOW
+    while days and days[0] <= cutoff:
+        days.pop(0)
+
+    for name, tasks in tasks_by_category.items():
+        counts = stats['categories'].setdefault(name, {'days': 0, 'tasks': 0})
+        counts['days'] += 1
+        counts['tasks'] += tasks
+
+def backfill(data):
+    """Build data['stats'] from history (once, during the schema upgrade)
+
+    History doesn't record categories, so category counts start empty.
+    """
+    data['stats'] = empty_stats()
+    for entry in data.get('history', []):
+        try:
+            day = datetime.fromisoformat(entry['date']).date()
+        except (KeyError, TypeError, ValueError):
+            continue
+        record_completion(data, day, entry.get('streak', 1), {})
+
+def completion_rates(stats, today, windows):
+    """{days: {'completed', 'rate'}} for each window ending today"""
+    days = stats['completedDays']
+    end = bisect.bisect_right(days, today.toordinal())
+    rates = {}
+    for window in windows:
+        start = bisect.bisect_right(days, today.toordinal() - window)
+        completed = end - start
+        rates[str(window)] = {'completed': completed, 'rate': round(completed / window, 3)}
+    return rates
+
+def streak_distribution(stats):
+    """Ended streaks counted per STREAK_BUCKETS label"""
+    distribution = {label: 0 for label, _, _ in STREAK_BUCKETS}
+    for length, count in stats['streaks'].items():
+        length = int(length)
+        for label, shortest, longest in STREAK_BUCKETS:
+            if length >= shortest and (longest is None or length <= longest):
+                distribution[label] += count
+                break
+    return distribution
+
+def report(data, today, windows=WINDOWS):
+    """The /api/stats payload for a document"""
+    stats = data.get('stats') or empty_stats()
+    return {
+        'completionRates': completion_rates(stats, today, windows),
+        'categories': stats['categories'],
+        'streaks': {
+            'current': data.get('currentStreak', 0),
+            'longest': data.get('longestStreak', 0),
+            'distribution': streak_distribution(stats),
+        },
+        'totalDaysCompleted': data.get('totalDaysCompleted', 0),
+        'asOf': today.isoformat(),
+    }
@@ -0,0 +1,120 @@
+"""
+Rate limiting and admission control for expensive routes
+
+Each user gets a token bucket per route (BUDGETS): a request spends one
+token, tokens refill continuously, and an empty bucket means 429 with the
+seconds until the next token in Retry-After. On top of that, at most
+MAX_EXPENSIVE_IN_FLIGHT expensive requests run at once across all workers;
+the next one is turned away with 503 instead of waiting for a slot.
+
+Buckets and in-flight slots live in a SQLite file (RATE_LIMIT_DB) that every
+gunicorn worker on the host opens, so the limits hold per instance rather
+than per process. A slot left behind by a killed worker expires after
+SLOT_TIMEOUT_SECONDS. If the store itself fails, requests are let through.
+"""
+import os
+import sqlite3
+import threading
+import time
+
+RATE_LIMIT_DB = os.environ.get('RATE_LIMIT_DB', 'rate_limits.sqlite3')
+# route -> (burst, tokens per minute)
+BUDGETS = {
+    'motivation_refresh': (5, 2),
+    'generate_quotes': (2, 0.1),
+}
+MAX_EXPENSIVE_IN_FLIGHT = int(os.environ.get('MAX_EXPENSIVE_IN_FLIGHT', 4))
+# Longest an expensive request can run (the gunicorn timeout)
+SLOT_TIMEOUT_SECONDS = int(os.environ.get('GUNICORN_TIMEOUT', 60))
+BUSY_RETRY_AFTER = 5
+
+_local = threading.local()
+
+def _connection():
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        # Autocommit, transactions are opened explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(RATE_LIMIT_DB, timeout=5, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                updated REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS in_flight (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started REAL NOT NULL
+            )
+        ''')
+        _local.conn = conn
+    return conn
+
+def take(route, user_id):
+    """Spend one of user_id's tokens for route
+
+    Returns None if the request may proceed, otherwise the seconds until a
+    token is available.
+    """
+    burst, per_minute = BUDGETS[route]
+    rate = per_minute / 60
+    key = f"{route}:{user_id}"
+    try:
+        conn = _connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            row = conn.execute('SELECT tokens, updated FROM buckets WHERE key = ?', (key,)).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            retry_after = None
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                retry_after = (1 - tokens) / rate
+            conn.execute(
+                'INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)',
+                (key, tokens, now)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return retry_after
+    except sqlite3.Error as e:
+        print(f"⚠️ Rate limit store unavailable, allowing request: {str(e)}")
+        return None
+
+def acquire_slot():
+    """Claim one of the MAX_EXPENSIVE_IN_FLIGHT slots
+
+    Returns a slot to hand to release_slot(), or None if all are taken. A
+    store failure returns 0, which release_slot() ignores.
+    """
+    try:
+        conn = _connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            conn.execute('DELETE FROM in_flight WHERE started < ?', (now - SLOT_TIMEOUT_SECONDS,))
+            (count,) = conn.execute('SELECT COUNT(*) FROM in_flight').fetchone()
+            slot = None
+            if count < MAX_EXPENSIVE_IN_FLIGHT:
+                slot = conn.execute('INSERT INTO in_flight (started) VALUES (?)', (now,)).lastrowid
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return slot
+    except sqlite3.Error as e:
+        print(f"⚠️ Rate limit store unavailable, allowing request: {str(e)}")
+        return 0
+
+def release_slot(slot):
+    if not slot:
+        return
+    try:
+        _connection().execute('DELETE FROM in_flight WHERE id = ?', (slot,))
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not release in-flight slot {slot}: {str(e)}")
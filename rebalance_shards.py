@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Move users to the shard the hash ring assigns them
+
+Run after adding a shard to DATABASE_SHARD_URLS, once every web worker is on
+the new configuration with SHARD_REBALANCING=1. Users are moved one at a time
+while the app keeps serving: a request for a user who hasn't been moved yet
+finds them on their old shard and moves them first. Archived users (see
+archive_users.py) are moved along with their archived row. Unset
+SHARD_REBALANCING when this script reports nothing left to move.
+
+Usage: python rebalance_shards.py [--dry-run]
+"""
+import sys
+
+from database import SHARDS, init_db, misplaced_usernames, move_user, shard_for
+
+def main():
+    dry_run = '--dry-run' in sys.argv[1:]
+    init_db()
+
+    moved = 0
+    for shard in SHARDS:
+        for username in list(misplaced_usernames(shard)):
+            target = shard_for(username)
+            if dry_run:
+                print(f"➡️ {username}: {shard['name']} -> {target['name']}")
+                moved += 1
+            elif move_user(username, shard, target):
+                moved += 1
+
+    action = 'to move' if dry_run else 'moved'
+    print(f"\n✅ Rebalance complete: {moved} users {action} across {len(SHARDS)} shards")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""
+User document schema versions
+
+Every document records the schema it follows in schemaVersion (documents
+from before versioning count as 0). Each upgrade step takes a document from
+one version to the next; migrate_schema.py runs them over every stored
+document once, so the request path only has to compare one integer.
+"""
+import habit_stats
+import item_ids
+import milestones
+import progress_stats
+
+CURRENT_SCHEMA_VERSION = 7
+
+def upgrade_categories(data):
+    """v1: the flat dailyTasks list becomes a 'General' category"""
+    if 'categories' not in data:
+        data['categories'] = [
+            {
+                'name': 'General',
+                'icon': '📝',
+                'tasks': [
+                    {'text': task, 'completed': False, 'recurring': True}
+                    for task in data.get('dailyTasks', [])
+                ]
+            }
+        ]
+    data.pop('dailyTasks', None)
+
+def upgrade_sections(data):
+    """v2: every top-level section exists
+
+    dailyMotivation starts empty, the dashboard fills it in on first load.
+    """
+    data.setdefault('currentStreak', 0)
+    data.setdefault('longestStreak', 0)
+    data.setdefault('lastCompletedDate', None)
+    data.setdefault('totalDaysCompleted', 0)
+    data.setdefault('milestones', [])
+    data.setdefault('dailyMotivation', {})
+    data.setdefault('endGoal', '')
+    data.setdefault('history', [])
+    data.setdefault('badHabits', [])
+
+def upgrade_habits(data):
+    """v3: habits count relapses in relapseCount and no longer store days clean
+
+    Relapse events are recorded outside the document from now on; an existing
+    relapses list no longer grows, and v7 moves it into the relapse events.
+    """
+    for habit in data['badHabits']:
+        habit.setdefault('relapseCount', len(habit.get('relapses', [])))
+        habit.pop('currentDaysClean', None)
+
+def upgrade_stats(data):
+    """v4: progress aggregates (see progress_stats.py), built from history"""
+    progress_stats.backfill(data)
+
+def upgrade_ids(data):
+    """v5: every category, task, milestone and habit has a stable ID"""
+    item_ids.assign_ids(data)
+
+def upgrade_milestone_order(data):
+    """v6: milestones are kept sorted by (targetDate, id)"""
+    milestones.sort_milestones(data)
+
+def upgrade_relapse_lists(data):
+    """v7: the legacy relapses lists are dropped, upgrade() imports them as events first"""
+    for habit in data['badHabits']:
+        habit.pop('relapses', None)
+
+# (version, step): step upgrades a document from version - 1 to version
+UPGRADES = [
+    (1, upgrade_categories),
+    (2, upgrade_sections),
+    (3, upgrade_habits),
+    (4, upgrade_stats),
+    (5, upgrade_ids),
+    (6, upgrade_milestone_order),
+    (7, upgrade_relapse_lists),
+]
+
+def is_current(data):
+    return data.get('schemaVersion', 0) >= CURRENT_SCHEMA_VERSION
+
+def upgrade(data, username=None):
+    """Bring data up to CURRENT_SCHEMA_VERSION in place, returns True if it changed
+
+    v7 first records the events in username's legacy relapses lists (see
+    habit_stats.import_legacy_relapses), which writes outside the document.
+    Without a username (reads, dry runs) the upgrade stops before v7, and
+    the save finishes it (see save_user_data in app.py). Importing is
+    idempotent, so a save that loses a version race can upgrade again.
+    """
+    start = data.get('schemaVersion', 0)
+    if start >= CURRENT_SCHEMA_VERSION:
+        return False
+    changed = False
+    for version, step in UPGRADES:
+        if version <= start:
+            continue
+        if step is upgrade_relapse_lists:
+            if username is None:
+                break
+            habit_stats.import_legacy_relapses(username, data['badHabits'])
+        step(data)
+        data['schemaVersion'] = version
+        changed = True
+    return changed
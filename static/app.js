@@ -20,6 +20,9 @@ function showSection(section) {
 // Load data
 async function loadData() {
   try {
+    // Local edits go out first so the copy we load already includes them
+    await syncNow();
+    if (sync.pending.length > 0) return;
     console.log("📥 Loading data...");
     const response = await fetch("/api/data");
     if (!response.ok) {
@@ -34,38 +37,322 @@ async function loadData() {
     renderAll();
   } catch (error) {
     console.error("❌ Error loading data:", error);
-    alert("Failed to load data! Check console for details.");
+    // A failed background refresh keeps showing what we have
+    if (!data) {
+      alert("Failed to load data! Check console for details.");
+    }
   }
 }
 
-// Save data
+// Save data (queued, see SYNC below)
 async function saveData() {
+  queueChange({ type: "save", data: data });
+  return true;
+}
+
+// ========== SYNC: WRITE COALESCING AND OFFLINE QUEUE ==========
+// Edits are applied to `data` right away and queued here. The queue is
+// debounced and coalesced, then sent as one /api/batch request (operations)
+// or one /api/data request (full saves). It is persisted in IndexedDB, so
+// edits made offline are replayed in order when the connection comes back.
+// Operations are applied to whatever the server has by then; a full save
+// only applies to the version it was made from, so it is kept for edits
+// no operation covers (the end goal).
+
+const SYNC_DEBOUNCE_MS = 400;
+const SYNC_RETRY_MS = 5000;
+const SYNC_DB_NAME = "momentum-sync";
+const SYNC_STORE = "pending";
+
+const sync = {
+  pending: [], // {type: "op", op: {...}} or {type: "save", data: {...}}
+  inFlight: [],
+  timer: null,
+  flushPromise: null,
+  db: null,
+  reloadAfterFlush: false,
+};
+
+function syncKey() {
+  return document.getElementById("username").textContent.trim();
+}
+
+function openSyncDb() {
+  return new Promise((resolve) => {
+    if (!window.indexedDB) return resolve(null);
+    const request = indexedDB.open(SYNC_DB_NAME, 1);
+    request.onupgradeneeded = () => request.result.createObjectStore(SYNC_STORE);
+    request.onsuccess = () => resolve(request.result);
+    request.onerror = () => resolve(null);
+  });
+}
+
+function persistQueue() {
+  if (!sync.db) return;
   try {
-    console.log("💾 Saving data...", data);
-    const response = await fetch("/api/data", {
-      method: "POST",
-      headers: { "Content-Type": "application/json" },
-      body: JSON.stringify(data),
-    });
+    const tx = sync.db.transaction(SYNC_STORE, "readwrite");
+    tx.objectStore(SYNC_STORE).put(sync.inFlight.concat(sync.pending), syncKey());
+  } catch (error) {
+    console.error("❌ Could not persist pending changes:", error);
+  }
+}
 
-    if (!response.ok) {
-      console.error("❌ Save failed - Response not OK:", response.status);
-      const errorText = await response.text();
-      console.error("Error details:", errorText);
-      alert("Failed to save data! Check console for details.");
+async function restoreQueue() {
+  sync.db = await openSyncDb();
+  if (!sync.db) return;
+  const stored = await new Promise((resolve) => {
+    const request = sync.db
+      .transaction(SYNC_STORE, "readonly")
+      .objectStore(SYNC_STORE)
+      .get(syncKey());
+    request.onsuccess = () => resolve(request.result || []);
+    request.onerror = () => resolve([]);
+  });
+  if (stored.length > 0 || sync.pending.length > 0) {
+    sync.pending = stored.concat(sync.pending);
+    persistQueue();
+  }
+  if (stored.length > 0) {
+    console.log(`📤 Replaying ${stored.length} change(s) saved while offline`);
+    // The page was rendered from the server copy, refresh once replayed
+    sync.reloadAfterFlush = true;
+    syncNow();
+  }
+}
+
+// Toggling the same item twice in a row is a no-op
+function cancelsOut(a, b) {
+  if (a.op !== b.op || !["toggleTask", "toggleMilestone"].includes(a.op)) {
+    return false;
+  }
+  return (
+    a.taskId === b.taskId &&
+    a.milestoneId === b.milestoneId &&
+    a.index === b.index &&
+    a.categoryIndex === b.categoryIndex &&
+    a.taskIndex === b.taskIndex
+  );
+}
+
+function queueChange(entry) {
+  if (entry.type === "save") {
+    // A full save carries every earlier local edit, so it replaces earlier
+    // saves; operations stay queued in case the save turns out stale
+    sync.pending = sync.pending.filter((e) => e.type !== "save");
+    sync.pending.push(entry);
+  } else {
+    const last = sync.pending[sync.pending.length - 1];
+    if (last && last.type === "op" && cancelsOut(last.op, entry.op)) {
+      sync.pending.pop();
+    } else {
+      sync.pending.push(entry);
+    }
+  }
+  persistQueue();
+  scheduleSync(SYNC_DEBOUNCE_MS);
+}
+
+function queueOperation(op) {
+  queueChange({ type: "op", op: op });
+}
+
+// Address items by ID when they have one, so queued operations survive
+// reordering; items added since the last sync only have their position
+function itemRef(kind, item, index) {
+  return item.id ? { [kind + "Id"]: item.id } : { index: index };
+}
+
+function categoryRef(catIndex) {
+  const category = data.categories[catIndex];
+  return category.id ? { categoryId: category.id } : { categoryIndex: catIndex };
+}
+
+function taskRef(catIndex, taskIndex) {
+  const task = data.categories[catIndex].tasks[taskIndex];
+  return task.id
+    ? { taskId: task.id }
+    : { categoryIndex: catIndex, taskIndex: taskIndex };
+}
+
+function scheduleSync(delay) {
+  clearTimeout(sync.timer);
+  sync.timer = setTimeout(syncNow, delay);
+}
+
+// Send everything queued; resolves once the queue is empty or we are offline
+async function syncNow() {
+  clearTimeout(sync.timer);
+  while (sync.pending.length > 0 && navigator.onLine) {
+    if (!sync.flushPromise) {
+      sync.flushPromise = flushQueue().finally(() => {
+        sync.flushPromise = null;
+      });
+    }
+    if (!(await sync.flushPromise)) break;
+  }
+}
+
+async function flushQueue() {
+  let latest = null;
+  let reload = false;
+  let discarded = null;
+
+  while (sync.pending.length > 0) {
+    const head = sync.pending[0];
+    let count = 1;
+    let url = "/api/data";
+    let body = head.data;
+    if (head.type === "op") {
+      while (count < sync.pending.length && sync.pending[count].type === "op") {
+        count++;
+      }
+      url = "/api/batch";
+      body = { operations: sync.pending.slice(0, count).map((e) => e.op) };
+    }
+    sync.inFlight = sync.pending.splice(0, count);
+    const baseVersion = data.version || 0;
+
+    let response;
+    try {
+      response = await fetch(url, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify(body),
+      });
+    } catch (error) {
+      console.warn("📴 Offline, keeping changes for later:", error);
+      sync.pending = sync.inFlight.concat(sync.pending);
+      sync.inFlight = [];
+      scheduleSync(SYNC_RETRY_MS);
       return false;
     }
 
-    const result = await response.json();
-    console.log("✅ Data saved successfully", result);
-    return true;
-  } catch (error) {
-    console.error("❌ Error saving data:", error);
-    alert("Network error saving data! Check console.");
-    return false;
+    if (response.status === 401) {
+      window.location.href = "/";
+      return false;
+    }
+    // Operations are safe to send again; only a full save can go stale
+    if (response.status >= 500 || (response.status === 409 && head.type === "op")) {
+      console.error("❌ Sync failed, will retry:", response.status);
+      sync.pending = sync.inFlight.concat(sync.pending);
+      sync.inFlight = [];
+      scheduleSync(SYNC_RETRY_MS);
+      return false;
+    }
+
+    const result = await response.json().catch(() => ({}));
+    sync.inFlight = [];
+    persistQueue();
+
+    if (response.status === 409) {
+      // Another device saved since our copy was loaded. Resending the full
+      // document would overwrite its edits: drop it, send the queued
+      // operations and reload the server's copy
+      console.warn("⚠️ Changed on another device, reloading instead of saving:", result.error);
+      discarded = "your data was changed on another device";
+      reload = true;
+    } else if (!response.ok) {
+      // Rejected (e.g. the item was deleted on another device): drop it and
+      // take the server's copy
+      console.error("❌ Change rejected by server:", result.error);
+      discarded = result.error || "the server rejected it";
+      reload = true;
+    } else if (result.data) {
+      latest = result.data;
+      // Our copy already has these operations; if nothing else was saved in
+      // between, it is now that version, so a following full save isn't stale
+      if ((latest.version || 0) === baseVersion + 1) {
+        data.version = latest.version;
+      }
+    } else if (result.version) {
+      data.version = result.version;
+    }
+  }
+
+  if (discarded) {
+    alert(`Some changes could not be saved (${discarded}). Showing your latest saved data.`);
+  }
+  if (reload || sync.reloadAfterFlush) {
+    sync.reloadAfterFlush = false;
+    await loadData();
+  } else if (latest && (latest.version || 0) >= (data.version || 0)) {
+    data = latest;
+    renderAll();
+  }
+  return true;
+}
+
+window.addEventListener("online", syncNow);
+
+// ========== END SYNC ==========
+
+// ========== LIVE UPDATES FROM OTHER DEVICES ==========
+// /api/events announces which sections of the document changed; we fetch
+// only those sections, and skip changes we already have.
+
+const changedResources = new Set();
+let changeTimer = null;
+let announcedVersion = 0;
+let changeRetries = 0;
+
+function connectEvents() {
+  if (!window.EventSource) return;
+  const source = new EventSource("/api/events");
+
+  source.addEventListener("change", (event) => {
+    const change = JSON.parse(event.data);
+    if ((change.version || 0) <= (data.version || 0)) return;
+    announcedVersion = Math.max(announcedVersion, change.version);
+    changeRetries = 0;
+    changedResources.add(change.resource);
+    clearTimeout(changeTimer);
+    changeTimer = setTimeout(fetchChanges, 200);
+  });
+
+  source.onerror = () => {
+    // The browser reconnects by itself unless the server refused the stream
+    if (source.readyState === EventSource.CLOSED) {
+      setTimeout(connectEvents, 60000);
+    }
+  };
+}
+
+async function fetchChanges() {
+  const resources = [...changedResources];
+  changedResources.clear();
+  // Our own queued edits would be overwritten; they are flushed first anyway
+  if (sync.pending.length > 0 || sync.inFlight.length > 0) {
+    await syncNow();
+  }
+  if (resources.includes("*")) {
+    await loadData();
+  } else {
+    try {
+      const response = await fetch(`/api/data?fields=${resources.join(",")}`);
+      if (!response.ok) return;
+      const changes = await response.json();
+      if ((changes.version || 0) > (data.version || 0)) {
+        Object.assign(data, changes);
+        renderAll();
+        console.log("🔄 Updated from another device:", resources);
+      }
+    } catch (error) {
+      console.warn("Could not fetch changes:", error);
+      return;
+    }
+  }
+  // With server write-behind the announced version can take a moment to
+  // become readable from every worker; try again briefly
+  if ((data.version || 0) < announcedVersion && changeRetries < 3) {
+    changeRetries++;
+    resources.forEach((resource) => changedResources.add(resource));
+    clearTimeout(changeTimer);
+    changeTimer = setTimeout(fetchChanges, 500 * changeRetries);
   }
 }
 
+// ========== END LIVE UPDATES ==========
+
 // Render all
 function renderAll() {
   renderStats();
@@ -234,25 +521,17 @@ function updateCompleteButton() {
 }
 
 // Toggle task
-async function toggleTask(catIndex, taskIndex) {
-  try {
-    const response = await fetch(`/api/tasks/${catIndex}/${taskIndex}/toggle`, {
-      method: "POST",
-    });
-
-    const result = await response.json();
-    if (response.ok) {
-      data = result.data;
-      renderCategories();
-    }
-  } catch (error) {
-    console.error("Error toggling task:", error);
-  }
+function toggleTask(catIndex, taskIndex) {
+  const task = data.categories[catIndex].tasks[taskIndex];
+  task.completed = !task.completed;
+  renderCategories();
+  queueOperation({ op: "toggleTask", ...taskRef(catIndex, taskIndex) });
 }
 
 // Complete day
 async function completeDay() {
   try {
+    await syncNow();
     const response = await fetch("/api/complete-day", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
@@ -273,22 +552,14 @@ async function completeDay() {
 }
 
 // Clear all checkboxes
-async function clearAllCheckboxes() {
+function clearAllCheckboxes() {
   if (!confirm("Clear all checkboxes? This will uncheck all tasks.")) return;
 
-  try {
-    const response = await fetch("/api/tasks/clear-all", {
-      method: "POST",
-    });
-
-    const result = await response.json();
-    if (response.ok) {
-      data = result.data;
-      renderCategories();
-    }
-  } catch (error) {
-    console.error("Error clearing checkboxes:", error);
-  }
+  data.categories.forEach((category) =>
+    category.tasks.forEach((task) => (task.completed = false)),
+  );
+  renderCategories();
+  queueOperation({ op: "clearAllTasks" });
 }
 
 // Modal functions
@@ -326,13 +597,18 @@ async function addTask() {
   const text = input.value.trim();
 
   if (text) {
+    queueOperation({
+      op: "addTask",
+      ...categoryRef(catIndex),
+      task: text,
+      recurring: recurring,
+    });
     data.categories[catIndex].tasks.push({
       text: text,
       completed: false,
       recurring: recurring,
     });
 
-    await saveData();
     renderCategories();
     closeModal("task-modal");
     input.value = "";
@@ -341,8 +617,8 @@ async function addTask() {
 
 async function deleteTask(catIndex, taskIndex) {
   if (confirm("Delete this task?")) {
+    queueOperation({ op: "deleteTask", ...taskRef(catIndex, taskIndex) });
     data.categories[catIndex].tasks.splice(taskIndex, 1);
-    await saveData();
     renderCategories();
   }
 }
@@ -360,6 +636,10 @@ async function addCategory() {
 
   if (name) {
     if (!data.categories) data.categories = [];
+    if (data.categories.some((cat) => cat.name.toLowerCase() === name.toLowerCase())) {
+      alert("Category already exists");
+      return;
+    }
 
     const icons = ["🎓", "💪", "❤️", "💼", "🎯", "📚", "🏃", "🎨", "💻", "🌟"];
     const icon = icons[data.categories.length % icons.length];
@@ -370,7 +650,7 @@ async function addCategory() {
       tasks: [],
     });
 
-    await saveData();
+    queueOperation({ op: "addCategory", name: name, icon: icon });
     renderCategories();
     closeModal("category-modal");
     input.value = "";
@@ -379,8 +659,8 @@ async function addCategory() {
 
 async function deleteCategory(index) {
   if (confirm("Delete this entire category and all its tasks?")) {
+    queueOperation({ op: "deleteCategory", ...itemRef("category", data.categories[index], index) });
     data.categories.splice(index, 1);
-    await saveData();
     renderCategories();
   }
 }
@@ -405,7 +685,7 @@ function renderBadHabits() {
       );
 
       const longestStreak = habit.longestStreak || 0;
-      const relapseCount = habit.relapses ? habit.relapses.length : 0;
+      const relapseCount = habit.relapseCount || 0;
 
       return `
             <div class="habit-item">
@@ -438,7 +718,9 @@ async function markRelapse(index) {
   if (!confirm("Record a relapse? This will reset your clean days.")) return;
 
   try {
-    const response = await fetch(`/api/bad-habits/${index}/relapse`, {
+    await syncNow();
+    const habit = data.badHabits[index];
+    const response = await fetch(`/api/bad-habits/${habit.id || index}/relapse`, {
       method: "POST",
     });
 
@@ -471,16 +753,16 @@ async function addBadHabit() {
   if (name && date) {
     if (!data.badHabits) data.badHabits = [];
 
+    const cleanSince = new Date(date).toISOString();
     data.badHabits.push({
       name: name,
-      cleanSince: new Date(date).toISOString(),
+      cleanSince: cleanSince,
       lastRelapseDate: null,
-      currentDaysClean: 0,
       longestStreak: 0,
-      relapses: [],
+      relapseCount: 0,
     });
 
-    await saveData();
+    queueOperation({ op: "addHabit", name: name, cleanSince: cleanSince });
     renderBadHabits();
     closeModal("habit-modal");
     document.getElementById("habit-name").value = "";
@@ -489,8 +771,8 @@ async function addBadHabit() {
 
 async function deleteHabit(index) {
   if (confirm("Delete this habit tracker?")) {
+    queueOperation({ op: "deleteHabit", ...itemRef("habit", data.badHabits[index], index) });
     data.badHabits.splice(index, 1);
-    await saveData();
     renderBadHabits();
   }
 }
@@ -504,8 +786,12 @@ function renderDeadlines() {
     data.milestones = [];
   }
 
-  // Filter for deadline tasks only (type: "deadline")
-  const deadlines = data.milestones.filter((m) => m.type === "deadline");
+  // Filter for deadline tasks only (type: "deadline"), keeping each one's
+  // position; the server keeps milestones sorted by due date
+  const deadlines = [];
+  data.milestones.forEach((m, i) => {
+    if (m.type === "deadline") deadlines.push({ ...m, actualIndex: i });
+  });
 
   if (deadlines.length === 0) {
     container.innerHTML =
@@ -516,12 +802,9 @@ function renderDeadlines() {
   const today = new Date();
   today.setHours(0, 0, 0, 0);
 
-  // Sort by due date (soonest first)
-  deadlines.sort((a, b) => new Date(a.targetDate) - new Date(b.targetDate));
-
   container.innerHTML = deadlines
-    .map((deadline, index) => {
-      const actualIndex = data.milestones.findIndex((m) => m === deadline);
+    .map((deadline) => {
+      const actualIndex = deadline.actualIndex;
       const target = new Date(deadline.targetDate);
       target.setHours(0, 0, 0, 0);
       const daysLeft = Math.ceil((target - today) / (1000 * 60 * 60 * 24));
@@ -623,16 +906,18 @@ async function addDeadline() {
   if (text && date) {
     if (!data.milestones) data.milestones = [];
 
-    data.milestones.push({
+    const deadline = {
       text: text,
       targetDate: date,
       type: "deadline", // This marks it as a deadline, not a milestone
       category: category || null,
       priority: priority,
       completed: false,
-    });
+    };
+    insertMilestone(deadline);
 
-    await saveData();
+    const { completed, ...params } = deadline;
+    queueOperation({ op: "addMilestone", ...params });
     renderDeadlines();
     closeModal("deadline-modal");
     document.getElementById("deadline-input").value = "";
@@ -641,20 +926,29 @@ async function addDeadline() {
 
 async function toggleDeadline(index) {
   data.milestones[index].completed = !data.milestones[index].completed;
-  await saveData();
+  queueOperation({ op: "toggleMilestone", ...itemRef("milestone", data.milestones[index], index) });
   renderDeadlines();
 }
 
 async function deleteDeadline(index) {
   if (confirm("Delete this deadline task?")) {
+    queueOperation({ op: "deleteMilestone", ...itemRef("milestone", data.milestones[index], index) });
     data.milestones.splice(index, 1);
-    await saveData();
     renderDeadlines();
   }
 }
 
 // ========== END DEADLINE TASKS FUNCTIONS ==========
 
+// Milestones (and deadlines) are kept in due date order, like on the server
+function insertMilestone(milestone) {
+  let position = data.milestones.length;
+  while (position > 0 && data.milestones[position - 1].targetDate > milestone.targetDate) {
+    position--;
+  }
+  data.milestones.splice(position, 0, milestone);
+}
+
 // Milestones functions (now filters OUT deadline tasks)
 function renderMilestones() {
   const list = document.getElementById("milestones-list");
@@ -664,7 +958,10 @@ function renderMilestones() {
   }
 
   // Filter for regular milestones only (NOT deadline type)
-  const milestones = data.milestones.filter((m) => m.type !== "deadline");
+  const milestones = [];
+  data.milestones.forEach((m, i) => {
+    if (m.type !== "deadline") milestones.push({ ...m, actualIndex: i });
+  });
 
   if (milestones.length === 0) {
     list.innerHTML =
@@ -677,7 +974,7 @@ function renderMilestones() {
 
   list.innerHTML = milestones
     .map((milestone) => {
-      const actualIndex = data.milestones.findIndex((m) => m === milestone);
+      const actualIndex = milestone.actualIndex;
       const target = new Date(milestone.targetDate);
       target.setHours(0, 0, 0, 0);
       const daysLeft = Math.ceil((target - today) / (1000 * 60 * 60 * 24));
@@ -730,14 +1027,14 @@ async function addMilestone() {
   if (text && date) {
     if (!data.milestones) data.milestones = [];
 
-    data.milestones.push({
+    insertMilestone({
       text: text,
       targetDate: date,
       type: "milestone", // Regular milestone, not a deadline
       completed: false,
     });
 
-    await saveData();
+    queueOperation({ op: "addMilestone", text: text, targetDate: date, type: "milestone" });
     renderMilestones();
     closeModal("milestone-modal");
     document.getElementById("milestone-input").value = "";
@@ -746,14 +1043,14 @@ async function addMilestone() {
 
 async function toggleMilestone(index) {
   data.milestones[index].completed = !data.milestones[index].completed;
-  await saveData();
+  queueOperation({ op: "toggleMilestone", ...itemRef("milestone", data.milestones[index], index) });
   renderMilestones();
 }
 
 async function deleteMilestone(index) {
   if (confirm("Delete this milestone?")) {
+    queueOperation({ op: "deleteMilestone", ...itemRef("milestone", data.milestones[index], index) });
     data.milestones.splice(index, 1);
-    await saveData();
     renderMilestones();
   }
 }
@@ -803,6 +1100,7 @@ async function refreshMotivation() {
     loadingSpinner.classList.add("active");
     loadingText.classList.add("active");
 
+    await syncNow();
     const response = await fetch("/api/motivation/refresh", {
       method: "POST",
     });
@@ -822,6 +1120,9 @@ async function refreshMotivation() {
       // Backend already saved - don't save again!
       renderMotivation();
       console.log("Motivation refreshed!");
+    } else if (response.status === 429 || response.status === 503) {
+      const retryAfter = response.headers.get("Retry-After") || "a few";
+      alert(`Too many refreshes, try again in ${retryAfter} seconds.`);
     }
   } catch (error) {
     console.error("Error refreshing motivation:", error);
@@ -1090,7 +1391,11 @@ function renderHistory() {
     return;
   }
 
-  const last7 = data.history.slice(-7);
+  // At most one completion per day, so only the last 7 entries can fall in the window
+  const weekAgo = new Date();
+  weekAgo.setHours(0, 0, 0, 0);
+  weekAgo.setDate(weekAgo.getDate() - 6);
+  const last7 = data.history.slice(-7).filter((entry) => new Date(entry.date) >= weekAgo);
   const rate = Math.round((last7.length / 7) * 100);
 
   document.getElementById("progress-bar").style.width = rate + "%";
@@ -1136,8 +1441,39 @@ document.addEventListener("keydown", (e) => {
   }
 });
 
-// Initialize
-loadData();
+// Initialize from the document embedded in the page, falling back to a fetch
+function readInitialData() {
+  const el = document.getElementById("initial-data");
+  if (!el) return null;
+  try {
+    return JSON.parse(el.textContent);
+  } catch (error) {
+    console.error("❌ Could not parse embedded data:", error);
+    return null;
+  }
+}
+
+const initialData = readInitialData();
+if (initialData) {
+  data = initialData;
+  console.log("✅ Data loaded from page", data);
+  renderAll();
+} else {
+  loadData();
+}
+
+restoreQueue();
+connectEvents();
+
+// Refresh in the background when the tab comes back into view, and push
+// pending edits out when it is hidden
+document.addEventListener("visibilitychange", () => {
+  if (document.visibilityState === "visible") {
+    loadData();
+  } else {
+    syncNow();
+  }
+});
 
 // Mobile sidebar toggle functions
 function toggleSidebar() {
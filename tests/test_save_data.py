@@ -0,0 +1,73 @@
+"""
+Full-document saves (POST /api/data) in JSON file mode
+
+Run from the repository root: python -m unittest discover tests
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('GEMINI_API_KEY', None)
+
+_previous_dir = os.getcwd()
+_work_dir = tempfile.mkdtemp()
+# The app keeps its data files in the working directory
+os.chdir(_work_dir)
+import app as momentum
+
+def tearDownModule():
+    os.chdir(_previous_dir)
+    shutil.rmtree(_work_dir, ignore_errors=True)
+
+class SaveDataTest(unittest.TestCase):
+    def setUp(self):
+        for name in os.listdir(_work_dir):
+            path = os.path.join(_work_dir, name)
+            if os.path.isfile(path):
+                os.remove(path)
+        self.client = momentum.app.test_client()
+        response = self.client.post('/api/register', json={'username': 'saver', 'passcode': '1234'})
+        self.assertEqual(response.status_code, 200)
+
+    def add_task(self, data, text):
+        data['categories'][0]['tasks'].append({'text': text, 'completed': False, 'recurring': True})
+        return self.client.post('/api/data', json=data)
+
+    def task_texts(self):
+        data = self.client.get('/api/data').json
+        return [task['text'] for task in data['categories'][0]['tasks']]
+
+    def test_first_save_of_new_user(self):
+        data = self.client.get('/api/data').json
+        response = self.add_task(data, 'read')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json['version'], 1)
+        self.assertEqual(self.task_texts(), ['read'])
+
+    def test_document_without_version(self):
+        # Documents saved before versioning have no version key at all
+        with momentum.users_file_lock:
+            users = momentum.load_users()
+            users['saver']['data'].pop('version', None)
+            momentum.save_users(users)
+        data = self.client.get('/api/data').json
+        self.assertNotIn('version', data)
+        response = self.add_task(data, 'walk')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.task_texts(), ['walk'])
+
+    def test_stale_save_is_refused(self):
+        stale = self.client.get('/api/data').json
+        self.assertEqual(self.add_task(self.client.get('/api/data').json, 'first').status_code, 200)
+        response = self.add_task(stale, 'second')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json['version'], 1)
+        self.assertEqual(self.task_texts(), ['first'])
+
+if __name__ == '__main__':
+    unittest.main()